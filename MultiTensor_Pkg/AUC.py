@@ -1,44 +1,102 @@
 import numpy as np
 
 
+def _pairs(counts):
+    # number of pairs within groups of the given sizes
+    counts=np.asarray(counts,dtype=np.int64)
+    return int((counts*(counts-1)//2).sum())
+
+
+def _ranks(x,rtol=1e-10):
+    """
+    Ranks 0,1,.. of the values x and the number of entries of each rank.
+    Sorted values closer than rtol (relative) share a rank, so two scores that differ only by floating point noise are tied.
+    """
+    if(len(x)==0):return np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64)
+    order=np.argsort(x,kind='mergesort')
+    xs=x[order]
+    new=np.r_[True,np.abs(np.diff(xs))>rtol*np.maximum(np.abs(xs[1:]),np.abs(xs[:-1]))]
+    ranks=np.empty(len(x),dtype=np.int64)
+    ranks[order]=np.cumsum(new)-1
+    return ranks,np.bincount(ranks)
+
+
+def _inversions(x):
+    """
+    Number of pairs j<i with x[j]>x[i], for an array of integer classes 0,1,...
+    Pairs are counted by the highest bit where x[j] and x[i] differ: among the entries that share the bits above it, entries with that bit 0 count the entries with that bit 1 before them.
+    The bits are visited from the highest, keeping the entries grouped by the bits above (in their original order within a group), so each bit costs O(n).
+    """
+    x=np.asarray(x,dtype=np.int64)
+    n=len(x)
+    if(n<2):return 0
+    order=np.arange(n)
+    n_inv=0
+    for b in reversed(range(int(x.max()).bit_length())):
+        y=x[order]
+        bit=(y>>b)&1
+        start=np.r_[True,(y[1:]>>(b+1))!=(y[:-1]>>(b+1))]
+        first=np.flatnonzero(start)
+        group=np.cumsum(start)-1
+        ones=np.cumsum(bit)-bit
+        ones_before=ones-ones[first][group]   # entries with bit 1 before each entry within its group
+        n_inv+=int(ones_before[bit==0].sum())
+        # Split each group in its entries with bit 0 then bit 1, keeping their order
+        zeros_before=np.arange(n)-first[group]-ones_before
+        n_zeros=np.bincount(group,weights=1-bit).astype(np.int64)
+        new_pos=np.where(bit==0,first[group]+zeros_before,first[group]+n_zeros[group]+ones_before)
+        new_order=np.empty(n,dtype=order.dtype)
+        new_order[new_pos]=order
+        order=new_order
+    return n_inv
+
+
+def weighted_auc(expected,actual):
+    """
+    Tie-aware AUC for integer weighted entries A_ij. Ideally, if an observed edge has A_ij=4, it will have a bigger expected value than an observed edge with A_ij<4.
+    The AUC is the fraction of pairs of entries with different A_ij that are ordered that way, pairs with equal expected values count 1/2.
+    Expected values equal up to a relative 1e-10 are tied, see _ranks, so the AUC does not depend on the summation order of mu_ij.
+    With binary A_ij it is the usual AUC.
+    - expected= # array of n expected values mu_ij, or n x L array to score L layers at once (one column per layer)
+    - actual= # array of the same shape with the actual weights A_ij
+    - returns the AUC, or the array of the L AUCs. It is nan when all the A_ij are equal.
+    The entries are sorted by (mu_ij, A_ij): the wrongly ordered pairs are the inversions of A_ij in that order, see _inversions.
+    Cost is one sort plus O(n) per bit of the number of weight classes, O(n log n) overall.
+    """
+    expected=np.asarray(expected,dtype=float)
+    actual=np.asarray(actual)
+    if(expected.ndim==1):
+        return weighted_auc(expected[:,np.newaxis],actual[:,np.newaxis])[0]
+
+    AUC=np.empty(expected.shape[1])
+    for l in range(expected.shape[1]):
+        m,m_counts=_ranks(expected[:,l])                                                # ranks of mu_ij, ties share a rank
+        _,a,a_counts=np.unique(actual[:,l],return_inverse=True,return_counts=True)     # weight classes 0,1,.. in increasing A_ij
+        ma=np.sort(m*len(a_counts)+a)                 # entries sorted by (mu_ij, A_ij)
+        ma_counts=np.diff(np.r_[np.flatnonzero(np.r_[True,ma[1:]!=ma[:-1]]),len(ma)])
+
+        Z=_pairs([len(a)])-_pairs(a_counts)           # pairs with different A_ij
+        ties=_pairs(m_counts)-_pairs(ma_counts)       # ... and equal mu_ij
+        wrong=_inversions(ma%len(a_counts))           # ... and mu_ij ordered the other way
+        AUC[l]=(Z-wrong-0.5*ties)/float(Z) if Z>0 else np.nan
+
+    return AUC
+
+
 def calculate_AUC(M,Pos,Neg):
-    # M= # SORTED (from small to big) List of 2-tuple, each entry is M[n]=(mu_ij,A_ij)      
-    # Pos= # positive entries (graph edges)         
-    # Neg= # negative entries (graph non-edges) 
-    y=0.;bad=0.;
-    for m,a,n in M:
-        if(a>=1.):
-            y+=1;
-        else:
-            bad+=y;      
-    AUC=1.-(bad/(Pos*Neg));     
-    return AUC;
+    # M= # List of 3-tuples, each entry is M[n]=(mu_ij,A_ij,n)
+    # Pos, Neg= # positive and negative entries, not needed anymore
+    m=[x[0] for x in M]
+    a=[x[1]>=1. for x in M]
+    return weighted_auc(m,a);
 
 
 def calculate_AUC_weighted(M,max_w):
     """"
-    AUC for weighted entries A_ij. Ideally, if an observed edge has A_ij=4, it will have a bigger M entry than an observed edge with A_ij<4
-    - M= # SORTED (from small to big) List of 2-tuple, each entry is M[n]=(mu_ij,A_ij)    
-    - m_k= multiplicity of A_ij=k entries      
-    - max_w is the maximum edge weigth, needed to order the y[k]
+    AUC for weighted entries A_ij, see weighted_auc
+    - M= # List of 2-tuple, each entry is M[n]=(mu_ij,A_ij)
+    - max_w is the maximum edge weigth, not needed anymore
     """
-
-    bad=0.
-    y=np.zeros(max_w+1)
-
-    for m, a in M:
-        y[a] += 1   # number of entries with A_ij=a already encountered
-        for q in range(a+1,max_w+1):
-            # number of entries with A_ij>a already encountered --> penalty
-            bad += y[q]
-    # calculate denominator --> normalization    
-    Z = 0
-    for k in range(max_w+1):
-        m = 0.
-        for q in range(k+1, max_w+1):
-            m += y[q]
-        Z += m*y[k]
-
-    AUC = 1.-(bad/float(Z))
-
-    return AUC;
\ No newline at end of file
+    m=[x[0] for x in M]
+    a=[x[1] for x in M]
+    return weighted_auc(m,a);
@@ -9,7 +9,7 @@ from numpy.random import RandomState
 import tools as tl
 
 class MultiTensor :
-	def __init__(self,N=100,L=1,K=2, N_real=1,tolerance=0.1,decision=10,maxit=500,rseed=0,out_adjacency=False,inf=1e10,err_max=0.00001,err=0.1,initialization=0,undirected=False,folder="data/",end_file="",adj="adjacency.dat",w_file="w.dat",assortative=False):	
+	def __init__(self,N=100,L=1,K=2, N_real=1,tolerance=0.1,decision=10,maxit=500,rseed=0,out_adjacency=False,inf=1e10,err_max=0.00001,err=0.1,initialization=0,undirected=False,folder="data/",end_file="",adj="adjacency.dat",w_file="w.dat",assortative=False,sparse=False,jobs=1,check_every=10,squarem=False,binary=False):	
 		self.N=N
 		self.L=L
 		self.K=K
@@ -29,6 +29,11 @@ class MultiTensor :
 		self.adj=adj
 		self.w_file=w_file
 		self.assortative=assortative
+		self.sparse=sparse  # Run EM sums only over the nonzero entries of the adjacency tensor
+		self.jobs=jobs  # Number of processes running realizations concurrently
+		self.check_every=check_every  # Number of EM iterations between two likelihood evaluations
+		self.squarem=squarem  # Accelerate EM with SQUAREM extrapolation steps
+		self.binary=binary  # Output results to a single .npz instead of text files
 
 		# Values used inside the update
 		self.u=np.zeros((self.N,self.K),dtype=float)  # Out-going membership
@@ -53,98 +58,81 @@ class MultiTensor :
 
 	def _randomize_w(self,rng):
 		" Assign a random number in (0,1.) to each entry"
-		for i in range(self.L):
-			for k in range(self.K):
-				if(self.assortative==True):self.w[k,i]=rng.random_sample(1)
-				else:
-					for q in range(k,self.K):
-						if(q==k):self.w[k,q,i]=rng.random_sample(1)
-						else: self.w[k,q,i]=self.w[q,k,i]=self.err*rng.random_sample(1)
+		" Entries are drawn in one block, in the same order as looping over layers and then over the upper triangle"
+		if(self.assortative==True):self.w[:,:]=rng.random_sample((self.L,self.K)).T
+		else:
+			k,q=np.triu_indices(self.K)
+			w=rng.random_sample((self.L,len(k)))
+			w[:,k!=q]*=self.err
+			self.w[k,q,:]=w.T
+			self.w[q,k,:]=w.T
 
 
 	def _randomize_u_v(self,rng,u_list,v_list):
 		" Randomize the memberships' entries different from zero"				
 		rng=np.random.RandomState(self.rseed)   # Mersenne-Twister random number generator
-		for k in range(self.K):
-			for i in range(len(u_list)):
-				j=u_list[i]
-				self.u[j][k]=rng.random_sample(1)
-				if(self.undirected==True):self.v[j][k]=self.u[j][k]
-			if(self.undirected==False):
-				for i in range(len(v_list)):
-					j=v_list[i]
-					self.v[j][k]=rng.random_sample(1)
+		u_list=np.asarray(u_list,dtype=int)
+		if(self.undirected==True):v_list=np.zeros(0,dtype=int)
+		else:v_list=np.asarray(v_list,dtype=int)
+		# One block with, for each group k, the entries of u_list followed by those of v_list
+		r=rng.random_sample((self.K,len(u_list)+len(v_list)))
+		self.u[u_list,:]=r[:,:len(u_list)].T
+		if(self.undirected==True):self.v[u_list,:]=self.u[u_list,:]
+		else:self.v[v_list,:]=r[:,len(u_list):].T
 			
 				
 
 	def _initialize_w(self,rng,infile_name):
-		" Initialize affinity matix from diagonal one extracted from file"	
+		" Initialize affinity matix from file written by output_results"	
+		" Rows 'l w_1 .. w_K' set the diagonal of layer l, blocks 'layer= l' followed by K rows set the whole matrix"	
 		infile=open(infile_name,'r')
-		nr=0
-		for line in infile:
-			if(nr>0):
-				a=line.strip('\n').split()
-				l=a[0]  # layer index
-				assert(len(a)==self.K+1)
-				for k in range(self.K):
-					if(assortative==False):self.w[k][k][l]=float(a[k+1])
-					else:self.w[k][l]=float(a[k+1])
+		infile.readline()  # skip the likelihood header
+		rows=[line.split() for line in infile if len(line.split())>0]
 		infile.close()			
-		for l in range(self.L):
-			for k in range(self.K):
-				if(self.assortative==True):self.w[k][l]+=self.err*rng.random_sample(1)	
-				else:
-					for q in range(self.K):
-						self.w[k][q][l]+=self.err*rng.random_sample(1)			
-
-
-
-	def _initialize_u(self,rng,infile_name,nodes):
-		" Initialize membership from file and nodes' list"	
-		" INPUT 'nodes' is graph node list G.nodes() containing the labels"		
-		infile=open(infile_name,'r')
-		nr=0;
-		max_entry=0.
-		assert(len(nodes)==self.N)
-		for line in infile:
-			a= line.strip('\n').split(); # removes \n and split words in a list of lenght 1+K
-			if(nr>0 and len(a)>0):
-				assert(self.K==len(a)-1)
-				if(a[0] in nodes):
-					i=nodes.index(a[0])
-					for k in range(self.K):
-						z=float(a[k+1]);   # Value of the memebership for node a[0] and group k
-						self.u[i][k]=z;
-						max_entry=max(max_entry,z)
-			nr+=1;  
-		for n in range(self.N):
-			for k in range(self.K):
-				self.u[n][k]+=max_entry*self.err*rng.random_sample(1)    
-		infile.close()    
-
-	def _initialize_v(self,rng,infile_name,nodes):
-		" Initialize membership from file and nodes' list"	
-		" INPUT 'nodes' is graph node list G.nodes() containing the labels"		
+		if(len(rows)>0 and rows[0][0]=="layer="):
+			assert(len(rows)==self.L*(self.K+1))
+			W=np.array([a for a in rows if a[0]!="layer="],dtype=float).reshape(self.L,self.K,self.K)
+			if(self.assortative==True):self.w[:,:]=np.diagonal(W,axis1=1,axis2=2).T
+			else:self.w[:,:,:]=W.transpose(1,2,0)
+		else:
+			a=np.array(rows,dtype=float).reshape(-1,self.K+1)
+			l=a[:,0].astype(int)  # layer index
+			k=np.arange(self.K)
+			if(self.assortative==False):self.w[k[:,np.newaxis],k[:,np.newaxis],l]=a[:,1:].T
+			else:self.w[:,l]=a[:,1:].T
+		if(self.assortative==True):self.w+=self.err*rng.random_sample((self.L,self.K)).T	
+		else:self.w+=self.err*rng.random_sample((self.L,self.K,self.K)).transpose(1,2,0)			
+
+	def _read_membership(self,infile_name,index):
+		" Read a membership file written by output_results"	
+		" INPUT 'index' is a dict node label -> INT INDEX"		
+		" OUTPUT INT INDECES of the nodes found in 'index' and their membership entries "	
+		a=np.loadtxt(infile_name,dtype=str,comments=None,skiprows=1,ndmin=2)   # one row of 1+K words per node
+		if(a.shape[0]==0):return np.zeros(0,dtype=int),np.zeros((0,self.K))
+		assert(self.K==a.shape[1]-1)
+		i=np.array([index.get(label,-1) for label in a[:,0]],dtype=int)
+		found=i>=0
+		return i[found],a[found,1:].astype(float)
+
+	def _initialize_u(self,rng,infile_name,index):
+		" Initialize membership from file and nodes' index"	
+		" INPUT 'index' is a dict node label -> INT INDEX"		
+		assert(len(index)==self.N)
+		i,z=self._read_membership(infile_name,index)
+		self.u[i,:]=z
+		max_entry=max(0.,z.max()) if z.size>0 else 0.
+		self.u+=max_entry*self.err*rng.random_sample((self.N,self.K))    
+
+	def _initialize_v(self,rng,infile_name,index):
+		" Initialize membership from file and nodes' index"	
+		" INPUT 'index' is a dict node label -> INT INDEX"		
 		if(self.undirected==True):self.v=self.u;
 		else:
-			infile=open(infile_name,'r')
-			nr=0;max_entry=0.;
-			assert(len(nodes)==self.N)
-			for line in infile:
-				a= line.strip('\n').split(); # removes \n and split words in a list of lenght 1+K
-				if(nr>0 and len(a)>0):
-					assert(self.K==len(a)-1)
-					if(a[0] in nodes):
-						i=nodes.index(a[0])
-						for k in range(self.K):
-							z=float(a[k+1]);   # Value of the memebership for node a[0] and group k
-							self.v[i][k]=z;
-							max_entry=max(max_entry,z)
-				nr+=1;  
-			for n in range(self.N):
-				for k in range(self.K):
-					self.v[n][k]+=max_entry*self.err*rng.random_sample(1)      
-			infile.close()   
+			assert(len(index)==self.N)
+			i,z=self._read_membership(infile_name,index)
+			self.v[i,:]=z
+			max_entry=max(0.,z.max()) if z.size>0 else 0.
+			self.v+=max_entry*self.err*rng.random_sample((self.N,self.K))      
 
 	def _initialize(self,u_list,v_list,nodes):         
 		
@@ -153,6 +141,7 @@ class MultiTensor :
 		infile1=os.path.join(self.folder, 'u_K'+str(self.K)+self.w_file)
 		infile2=os.path.join(self.folder, 'v_K'+str(self.K)+self.w_file)
 		w_infile=os.path.join(self.folder, 'w_K'+str(self.K)+self.w_file)
+		if(self.initialization in [1,3]):index=dict((n,i) for i,n in enumerate(nodes))
 
 		if(self.initialization==0):
 			print " Random initializations"
@@ -164,9 +153,9 @@ class MultiTensor :
 			print infile1;
 			print infile2;
 			print w_infile;
-			self._initialize_u(rng,infile1,nodes)
-			self._initialize_v(rng,infile2,nodes)
-			self._initialize_w(w_infile)
+			self._initialize_u(rng,infile1,index)
+			self._initialize_v(rng,infile2,index)
+			self._initialize_w(rng,w_infile)
 
 		elif(self.initialization==2):
 			print " W initialized using: ";
@@ -174,16 +163,16 @@ class MultiTensor :
 			self._initialize_w(rng,w_infile)	
 			self._randomize_u_v(rng,u_list,v_list)	
 		
-		elif(initialization==3):
+		elif(self.initialization==3):
 			print " U and V are initialized using: ";
 			print infile1;
 			print infile2;
 			self._randomize_w(rng)	
-			self._initialize_u(rng,infile1,nodes)
-			self._initialize_v(rng,infile2,nodes)
+			self._initialize_u(rng,infile1,index)
+			self._initialize_v(rng,infile2,index)
 
 	def output_membership(self,nodes):		
-		" INPUT 'nodes' is graph node list G.nodes() containing the labels"		
+		" INPUT 'nodes' is the node list containing the labels"		
 		print " u : ";
 		for i in range(self.N):
 			print nodes[i],
@@ -216,17 +205,11 @@ class MultiTensor :
 		print;	
 
 	def _update_old_variables(self,u_list,v_list):
-		for i in range(len(u_list)):
-			for k in range(self.K):
-				self.u_old[u_list[i]][k]=self.u[u_list[i]][k]	
-		for i in range(len(v_list)):
-			for k in range(self.K):self.v_old[v_list[i]][k]=self.v[v_list[i]][k]	
-		for l in range(self.L):
-			for k in range(self.K):	
-				if(self.assortative==True):self.w_old[k][l]=self.w[k][l]	
-				else:
-					for q in range(self.K):
-						self.w_old[k][q][l]=self.w[k][q][l]	
+		u_list=np.asarray(u_list,dtype=int)
+		v_list=np.asarray(v_list,dtype=int)
+		self.u_old[u_list,:]=self.u[u_list,:]	
+		self.v_old[v_list,:]=self.v[v_list,:]	
+		self.w_old[...]=self.w	
 
 
 	def _update_optimal_parameters(self):
@@ -237,10 +220,14 @@ class MultiTensor :
 	def output_results(self,maxL,nodes):
 		" Output results after convergence "
 
+		if(self.binary==True):
+			self._output_results_binary(maxL,nodes)
+			return
+
 		# SORT node list if possible
 		sorting=tl.can_cast(nodes[0])
 		if(sorting==True):
-			node_list=np.sort( [int(i) for i in nodes] )
+			order=np.argsort( [int(i) for i in nodes], kind='mergesort' )
 			print "Sorting the membership vectors..."
 		infile1=os.path.join(self.folder, "u_K"+str(self.K)+self.end_file)
 		infile3=os.path.join(self.folder, "w_K"+str(self.K)+self.end_file)
@@ -257,8 +244,8 @@ class MultiTensor :
 		# Output membership
 
 		if(sorting==True):
-			for u in node_list:	
-				i=nodes.index(str(u))
+			for i in order:	
+				u=int(nodes[i])
 				print >>in1,u,
 				if(self.undirected==False):print >> in2, u,
 				for k in range(self.K):
@@ -302,6 +289,19 @@ class MultiTensor :
 		if(self.undirected==False):print infile2;
 
 
+	def _output_results_binary(self,maxL,nodes):
+		" Output u, v, w, node labels, max likelihood and run parameters to a single .npz, see tools.save_results "
+		outfile=tl.results_file(self.folder,str(self.K)+self.end_file)
+		tl.save_results(outfile,self.u_f,self.v_f,self.w_f,nodes,maxL,
+				N_real=self.N_real,K=self.K,L=self.L,
+				assortative=self.assortative,undirected=self.undirected,
+				tolerance=self.tolerance,decision=self.decision,maxit=self.maxit,err=self.err)
+		
+		self._output_affinity_matrix()	# output on screen				 
+
+		print "Data saved in:";
+		print outfile;
+
 	# ----------	----------	----------	----------	----------	
 	# ----------  Functions needed in the update_EM routine ----------	
 	# ----------	----------	----------	----------	----------	
@@ -406,84 +406,303 @@ class MultiTensor :
 
 		return dist_w		
 
+	# ----------	----------	----------	----------	----------	
+	# ----------  Sparse versions: B=(subs,data) nonzero entries ----------	
+	# ----------	----------	----------	----------	----------	
+
+	def _sparse_membership(self,x,row,rho,data,Z_k):
+		" Multiplicative membership update summed over the nonzero entries only"
+		" x_ik <- x_ik/Z_k * sum_n A_n*rho_nk/Z_n, with Z_n=sum_q x_iq*rho_nq and i=row[n] "
+		Z=np.einsum('nk,nk->n',x[row],rho)
+		non_zeros=Z>0.
+		ratio=np.zeros_like(Z)
+		ratio[non_zeros]=data[non_zeros]/Z[non_zeros]
+		rho=rho*ratio[:,np.newaxis]
+
+		x_new=np.zeros_like(x)
+		for k in range(self.K):x_new[:,k]=np.bincount(row,weights=rho[:,k],minlength=self.N)
+
+		non_zeros=Z_k>0.
+		x_new[:,non_zeros]*=x[:,non_zeros]/Z_k[non_zeros]
+		x_new[:,~non_zeros]=0.
+
+		return x_new
+
+	def _update_U_sparse(self,B):
+
+		subs,data=B
+		Du=np.einsum('iq->q',self.v_old)
+		if(self.assortative==False):
+			w_k=np.einsum('kqa->kq',self.w_old)
+			Z_uk=np.einsum('q,kq->k',Du,w_k)
+			rho_ajk=np.einsum('jq,kqa->ajk',self.v_old,self.w_old)
+		else:
+			w_k=np.einsum('ka->k',self.w_old)
+			Z_uk=np.einsum('k,k->k',Du,w_k)
+			rho_ajk=np.einsum('jk,ka->ajk',self.v_old,self.w_old)
+
+		self.u=self._sparse_membership(self.u,subs[1],rho_ajk[subs[0],subs[2]],data,Z_uk)
+
+		low_values_indices = self.u < self.err_max  # Where values are low
+		self.u[low_values_indices] = 0.  # All low values set to 0
+		dist_u=np.amax(abs(self.u-self.u_old))	
+		self.u_old=self.u
+
+		return dist_u	
+
+	def _update_V_sparse(self,B):
+
+		subs,data=B
+		Dv=np.einsum('iq->q',self.u_old)
+		if(self.assortative==False):
+			w_k=np.einsum('qka->qk',self.w_old)
+			Z_vk=np.einsum('q,qk->k',Dv,w_k)
+			rho_ajk=np.einsum('jq,qka->ajk',self.u_old,self.w_old)
+		else:	
+			w_k=np.einsum('ka->k',self.w_old)
+			Z_vk=np.einsum('k,k->k',Dv,w_k)
+			rho_ajk=np.einsum('jk,ka->ajk',self.u_old,self.w_old)
+
+		self.v=self._sparse_membership(self.v,subs[2],rho_ajk[subs[0],subs[1]],data,Z_vk)
+
+		low_values_indices = self.v < self.err_max  # Where values are low
+		self.v[low_values_indices] = 0.  # All low values set to 0
+
+		dist_v=np.amax(abs(self.v-self.v_old))	
+		self.v_old=self.v
+
+		return dist_v		
+
+	def _update_W_sparse(self,B):
+
+		subs,data=B
+		uk=np.einsum('ik->k',self.u)
+		vk=np.einsum('ik->k',self.v)
+		if(self.assortative==False):
+			Z_kq=np.einsum('k,q->kq',uk,vk)
+			Z_ajk=np.einsum('jq,kqa->ajk',self.v,self.w_old)
+		else:
+			Z_kq=np.einsum('k,k->k',uk,vk)
+			Z_ajk=np.einsum('jk,ka->ajk',self.v,self.w_old)
+
+		u_nz=self.u[subs[1]]
+		Z=np.einsum('nk,nk->n',u_nz,Z_ajk[subs[0],subs[2]])
+		non_zeros=Z>0.
+		ratio=np.zeros_like(Z)
+		ratio[non_zeros]=data[non_zeros]/Z[non_zeros]
+		u_nz*=ratio[:,np.newaxis]
+		v_nz=self.v[subs[2]]
+
+		# Entries are sorted by layer: sum each layer over its own slice
+		bounds=np.searchsorted(subs[0],np.arange(self.L+1))
+		rho_kqa=np.zeros_like(self.w_old)
+		for a in range(self.L):
+			s=slice(bounds[a],bounds[a+1])
+			if(self.assortative==False):rho_kqa[:,:,a]=np.dot(u_nz[s].T,v_nz[s])
+			else:rho_kqa[:,a]=np.einsum('nk,nk->k',u_nz[s],v_nz[s])
+
+		non_zeros=Z_kq>0.
+		self.w=np.zeros_like(self.w_old)
+		self.w[non_zeros]=rho_kqa[non_zeros]*self.w_old[non_zeros]/Z_kq[non_zeros][:,np.newaxis]
+
+		low_values_indices = self.w < self.err_max  # Where values are low
+		self.w[low_values_indices] = 0.  # All low values set to 0
+
+		dist_w=np.amax(abs(self.w-self.w_old))	
+		self.w_old=self.w
+
+		return dist_w		
+
 	
 	def _update_em(self,B):
 
-		d_u=self._update_U(B)
-		d_v=self._update_V(B)
-		d_w=self._update_W(B)
+		if(self.sparse==True):
+			d_u=self._update_U_sparse(B)
+			d_v=self._update_V_sparse(B)
+			d_w=self._update_W_sparse(B)
+		else:
+			d_u=self._update_U(B)
+			d_v=self._update_V(B)
+			d_w=self._update_W(B)
 
 		return d_u,d_v,d_w
 
 
+	def _set_parameters(self,u,v,w):
+		" Make (u,v,w) the current parameters, as they are right after an EM update"
+		self.u=self.u_old=np.copy(u)
+		self.v=self.v_old=np.copy(v)
+		self.w=self.w_old=np.copy(w)
+
+	def _update_squarem(self,B,E):
+		" One SQUAREM cycle (Varadhan and Roland, Scand. J. Stat. 2008) around the EM update F"
+		" theta'=theta0-2*alpha*r+alpha^2*v with r=F(theta0)-theta0, v=F(F(theta0))-2F(theta0)+theta0 and alpha=-|r|/|v|,"
+		" where entries that would turn negative keep their F(F(theta0)) value, followed by one EM update. If that lowers the likelihood"
+		" below the one of F(F(theta0)) (or breaks it), the plain EM point F(F(theta0)) is kept instead."
+		" OUTPUT: number of EM updates done, likelihood of the new parameters, 1 if the extrapolation was accepted "
+		theta0=(np.copy(self.u),np.copy(self.v),np.copy(self.w))
+		self._update_em(B)
+		theta1=(np.copy(self.u),np.copy(self.v),np.copy(self.w))
+		self._update_em(B)
+		theta2=(np.copy(self.u),np.copy(self.v),np.copy(self.w))
+		l2=self._Likelihood(E)
+
+		r=[t1-t0 for t0,t1 in zip(theta0,theta1)]
+		v=[t2-2*t1+t0 for t0,t1,t2 in zip(theta0,theta1,theta2)]
+		norm_r=np.sqrt(sum((x**2).sum() for x in r))
+		norm_v=np.sqrt(sum((x**2).sum() for x in v))
+		if(norm_v==0.):return 2,l2,0   # fixed point reached
+		alpha=min(-norm_r/norm_v,-1.)   # alpha=-1 gives back F(F(theta0))
+		if(alpha==-1.):return 2,l2,0
+
+		theta=[t0-2*alpha*x+alpha**2*y for t0,x,y in zip(theta0,r,v)]
+		theta=[np.where(t<0.,t2,t) for t,t2 in zip(theta,theta2)]  # keep non-negative
+		self._set_parameters(*theta)
+		with np.errstate(divide='ignore',invalid='ignore'):
+			self._update_em(B)
+			if(all(np.isfinite(x).all() for x in (self.u,self.v,self.w))):
+				l_new=self._Likelihood(E)
+				if(l_new>=l2):return 3,l_new,1
+
+		self._set_parameters(*theta2)   # monotone safeguard
+		return 3,l2,0
+
 	# --------------------------------------------------
 	# Function needed to iterate
 	# --------------------------------------------------				
 
-	def _Likelihood(self,A):
+	def _Likelihood(self,E):
+		" Poisson log-likelihood: sum over the nonzero entries of A*log(mu) minus the total expected weight"
+		" INPUT E=(subs,data) nonzero entries of the adjacency tensor, see tools.sparse_entries"
+		" The total expected weight is taken in closed form from the column sums of u and v, no N x N x L array is built"
+		subs,data=E
+		uk=np.einsum('ik->k',self.u)
+		vk=np.einsum('ik->k',self.v)
 		if(self.assortative==False):
-			mu_ija=np.einsum('kql,jq->klj',self.w,self.v);
-		else:	
-			mu_ija=np.einsum('kl,jk->klj',self.w,self.v);
-		mu_ija=np.einsum('ik,klj->lij',self.u,mu_ija);   
-		l=-mu_ija.sum()
-		non_zeros=A>0
-		logM=np.log(mu_ija[non_zeros])
-		Alog=A[non_zeros]*logM
-		l+=Alog.sum()
-		
+			l=-np.einsum('k,q,kqa->',uk,vk,self.w)
+			mu_ajk=np.einsum('jq,kqa->ajk',self.v,self.w)
+		else:
+			l=-np.einsum('k,k,ka->',uk,vk,self.w)
+			mu_ajk=np.einsum('jk,ka->ajk',self.v,self.w)
+		mu=np.einsum('nk,nk->n',self.u[subs[1]],mu_ajk[subs[0],subs[2]])
+		l+=(data*np.log(mu)).sum()
+
 		if(np.isnan(l)):
 			print "Likelihood is NaN!!!!"
 			sys.exit(1)
 		else:return l			
 
 
-	def _check_for_convergence(self,B,it,l2,coincide,convergence):
-		if(it % 10 ==0):
+	def _check_for_convergence(self,E,it,l2,coincide,convergence,steps=1,l_new=None):
+		" 'steps' is the number of EM updates done since the last call, 'l_new' their likelihood if already known"
+		" The likelihood is checked when these updates reach a multiple of check_every, so plain EM and SQUAREM check at the same cadence of EM updates"
+		if((it+steps-1)//self.check_every!=(it-1)//self.check_every):
 			old_L=l2
-			l2=self._Likelihood(B)	
+			if(l_new is not None):l2=l_new
+			else:l2=self._Likelihood(E)	
 			if(abs(l2-old_L)<self.tolerance): coincide+=1
 			else: coincide=0
 		if(coincide>self.decision):convergence=True	
-		it+=1
+		it+=steps
 
 		return it,l2,coincide,convergence	
 
-	def cycle_over_realizations(self,A,B,u_list,v_list):
-		maxL=-1000000000;
-		nodes=A[0].nodes()
-
-		for r in range(self.N_real):
-				
-			self._initialize(u_list,v_list,nodes)
-			
-			self._update_old_variables(u_list,v_list)
-
-			# Convergence local variables
-			coincide=0
-			convergence=False
-			it=0
-			l2=self.inf
-			#maxL=self.inf
-			delta_u=delta_v=delta_w=self.inf
-
-			print "Updating r=",r," ..."
-			tic=time.clock()
-			# ------------------- Single step iteration update ------------------*/
-			while(convergence==False and it<self.maxit):
+	def _fit_realization(self,B,u_list,v_list,nodes,r,rseed):
+		" Run realization r of EM from the initialization drawn with seed rseed"
+		" OUTPUT: final likelihood, number of iterations, cpu time and the fitted u, v, w "
+		self.rseed=rseed
+		self._initialize(u_list,v_list,nodes)
+		
+		self._update_old_variables(u_list,v_list)
+
+		# Convergence local variables
+		coincide=0
+		convergence=False
+		it=0
+		l2=self.inf
+		#maxL=self.inf
+		delta_u=delta_v=delta_w=self.inf
+
+		if(self.sparse==True):E=B
+		else:E=tl.sparse_entries(B)  # nonzero entries used by the likelihood
+
+		print "Updating r=",r," ..."
+		tic=time.clock()
+		# ------------------- Single step iteration update ------------------*/
+		accepted=0
+		while(convergence==False and it<self.maxit):
+			if(self.squarem==True and self.maxit-it>=3):
+				# Accelerated update: two EM updates, extrapolation and one stabilizing EM update. Near maxit plain EM updates are done instead, so it stops at maxit
+				steps,l_new,extrapolated=self._update_squarem(B,E)
+				accepted+=extrapolated
+				it,l2,coincide,convergence=self._check_for_convergence(E,it,l2,coincide,convergence,steps,l_new)
+			else:
 				# Main EM update: updates membership and calculates max difference new vs old
 				delta_u,delta_v,delta_w=self._update_em(B)
 
-				it,l2,coincide,convergence=self._check_for_convergence(B,it,l2,coincide,convergence)
-			print "r=",r," Likelihood=",l2," iterations=",it,' time=',time.clock()-tic,'s';
+				it,l2,coincide,convergence=self._check_for_convergence(E,it,l2,coincide,convergence)
+		if(self.squarem==True):print "r=",r," SQUAREM accepted",accepted,"extrapolations"
+
+		return l2,it,time.clock()-tic,self.u,self.v,self.w
+
+	def _parallel_realizations(self,B,u_list,v_list,nodes,seeds):
+		" Run one realization per seed over a pool of self.jobs processes"
+		" B is copied once into shared memory and inherited read-only by the workers, only the seeds are sent per task "
+		pool=tl.start_pool(min(self.jobs,len(seeds)),_init_worker,(self,tl.share_tensor(B),u_list,v_list,nodes))
+		return tl.pool_map(pool,_fit_worker,list(enumerate(seeds)))
+
+	def fit(self,nodes,B,u_list,v_list):
+		" Run the N_real realizations and keep in u_f, v_f, w_f the parameters with max likelihood"
+		" INPUT 'nodes' is the node label list, node i has label nodes[i]"		
+		" OUTPUT the max likelihood "
+		maxL=-1000000000;
+		if(self.sparse==True and isinstance(B,np.ndarray)):B=tl.sparse_entries(B)
+
+		seeds=[self.rseed+r for r in range(self.N_real)]
+		if(self.jobs>1 and self.N_real>1):
+			print "Updating",self.N_real,"realizations on",min(self.jobs,self.N_real),"processes ..."
+			results=self._parallel_realizations(B,u_list,v_list,nodes,seeds)
+		else:
+			results=(self._fit_realization(B,u_list,v_list,nodes,r,rseed) for r,rseed in enumerate(seeds))
+
+		for r,(l2,it,dt,u,v,w) in enumerate(results):
+			print "r=",r," Likelihood=",l2," iterations=",it,' time=',dt,'s';
 			if(maxL<l2): 
+				self.u,self.v,self.w=u,v,w
 				self._update_optimal_parameters()
 				maxL=l2
-			self.rseed+=1	
+		self.rseed=seeds[-1]+1	
 		# end cycle over realizations
 	
 		print "Final Likelihood=",maxL
 
-		self.output_results(maxL,A[0].nodes())	
-				
-	
+		return maxL
+
+	def cycle_over_realizations(self,nodes,B,u_list,v_list):
+		" Fit and output the results, see fit"
+		maxL=self.fit(nodes,B,u_list,v_list)
+
+		self.output_results(maxL,nodes)
+
+	def expected_weights(self,i,j):
+		" Expected weights mu_ija of the pairs (i[n],j[n]) with the final parameters u_f, v_f, w_f"
+		" INPUT INT INDECES i and j of the source and target nodes "
+		" OUTPUT array of shape len(i) x L "
+		if(self.assortative==False):return np.einsum('nk,kqa,nq->na',self.u_f[i],self.w_f,self.v_f[j])
+		else:return np.einsum('nk,ka,nk->na',self.u_f[i],self.w_f,self.v_f[j])
+
+
+# --------------------------------------------------
+# Process pool workers for parallel realizations
+# --------------------------------------------------
+
+_worker={}
+
+def _init_worker(MT,B,u_list,v_list,nodes):
+	" Keep the model and the shared adjacency inherited from the parent in the worker's globals"
+	_worker['MT']=MT
+	_worker['args']=(B,u_list,v_list,nodes)
+
+def _fit_worker(task):
+	" task=(r,rseed)"
+	return _worker['MT']._fit_realization(*(_worker['args']+task))
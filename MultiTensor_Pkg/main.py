@@ -1,6 +1,5 @@
 import MultiTensor as mt
 import numpy as np
-import networkx as nx
 from argparse import ArgumentParser
 import sys
 import tools as tl
@@ -26,26 +25,29 @@ def main():
 	p.add_argument('-u','--undirected',type=int,default=0)
 	p.add_argument('-z', '--rseed', type=int, default=0)
 	p.add_argument('-y','--decision',type=int,default=2)
+	p.add_argument('-s','--sparse',type=int,default=0)
+	p.add_argument('-j','--jobs',type=int,default=1)
+	p.add_argument('-c','--check_every',type=int,default=10)
+	p.add_argument('-S','--squarem',type=int,default=0)
+	p.add_argument('-b','--binary',type=int,default=0)
 	args = p.parse_args()
 	
 	folder="../data/"+args.folder
-	if(args.undirected==True):A=[ nx.MultiGraph() for l in range(args.L) ]   # list of graphs
-	else:A=[ nx.MultiDiGraph() for l in range(args.L) ]   # list of graphs
-
-	tl.read_graph(folder,args.adj,A)
+	A,B,nodes,index=tl.read_adjacency(folder,args.adj,args.L,undirected=bool(args.undirected))   # list of per-layer sparse matrices, nonzero entries
 	print "Undirected=",bool(args.undirected)
 	print "Assortative=",bool(args.assortative)
 	tl.print_graph_stat(A)
 
-	if(args.out_adjacency):tl.out_graph(folder,A)
+	if(args.out_adjacency):tl.out_graph(folder,A,nodes,undirected=bool(args.undirected))
 
+	k_out,k_in=tl.node_degrees(A)   # total out and in degree of each node over all layers
 	if(args.undirected==True): 
-		u_list=v_list=tl.remove_zero_entries_undirected(A) 
+		u_list=v_list=tl.remove_zero_entries_undirected(A,k_out) 
 	else:
-		u_list=tl.remove_zero_entries_u(A)   # list of INT INDECES of nodes with zero out degree
-		v_list=tl.remove_zero_entries_v(A)   # list of INT INDECES of nodes with zero in degree
+		u_list=tl.remove_zero_entries_u(A,k_out)   # array of INT INDECES of nodes with nonzero out degree
+		v_list=tl.remove_zero_entries_v(A,k_in)   # array of INT INDECES of nodes with nonzero in degree
 
-	MT=mt.MultiTensor(  N=A[0].number_of_nodes(),
+	MT=mt.MultiTensor(  N=len(nodes),
 			L=args.L,K=args.K, 
 			N_real=args.N_real,
 			tolerance=args.tolerance,
@@ -62,16 +64,18 @@ def main():
 			end_file=args.end_file,
 			adj=args.adj,
 			w_file=args.w_file,
-			assortative=bool(args.assortative)
+			assortative=bool(args.assortative),
+			sparse=bool(args.sparse),
+			jobs=args.jobs,
+			check_every=args.check_every,
+			squarem=bool(args.squarem),
+			binary=bool(args.binary)
 			)
 
 	tic = time.clock()
-	N=A[0].number_of_nodes()
-	B=np.empty(shape=[args.L,N,N])
-
-	for l in range(args.L):B[l,:,:]=nx.to_numpy_matrix(A[l],weight='weight')
+	if(args.sparse==False):B=tl.dense_tensor(A)
 	
-	MT.cycle_over_realizations(A,B,u_list,v_list)		
+	MT.cycle_over_realizations(nodes,B,u_list,v_list)		
 
 	#tl.print_graph_stat(A)	
 
@@ -0,0 +1,121 @@
+"""
+Select K in-process: fit MultiTensor for several K on the adjacency loaded once and score each fit on held-out edges.
+"""
+import time
+from argparse import ArgumentParser
+import numpy as np
+import MultiTensor as mt
+import tools as tl
+import AUC
+
+def score_holdout(MT,index,holdout):
+	" Summed AUC over the layers of the expected vs held-out edge weights"
+	" INPUT 'holdout' is (sources,targets,weights) as returned by tools.read_edge_list"
+	" The holdout columns are the last layers of the fit, e.g. only the test layer of a two-layer fit"
+	" Nodes not seen in training get expected weight 0; layers where all held-out weights are equal are skipped "
+	sources,targets,weights=holdout
+	i=np.array([index.get(v,-1) for v in sources],dtype=int)
+	j=np.array([index.get(v,-1) for v in targets],dtype=int)
+	known=(i>=0)&(j>=0)
+	mu=np.zeros(weights.shape)
+	mu[known]=MT.expected_weights(i[known],j[known])[:,MT.L-weights.shape[1]:]
+	return np.nansum(AUC.weighted_auc(mu,weights))
+
+def _fit_K(K,B,u_list,v_list,nodes,index,holdout,params):
+	tic=time.time()
+	MT=mt.MultiTensor(N=len(nodes),K=K,**params)
+	maxL=MT.fit(nodes,B,u_list,v_list)
+	auc=score_holdout(MT,index,holdout)
+	return K,maxL,auc,time.time()-tic
+
+def _prepare(A,B,params):
+	" Node lists of the update and the tensor in the form MultiTensor expects, dense unless params['sparse'] "
+	k_out,k_in=tl.node_degrees(A)
+	if(params.get('undirected',False)==True):u_list=v_list=tl.remove_zero_entries_undirected(A,k_out)
+	else:
+		u_list=tl.remove_zero_entries_u(A,k_out)
+		v_list=tl.remove_zero_entries_v(A,k_in)
+	if(params.get('sparse',False)==False):B=tl.dense_tensor(A)
+	return B,u_list,v_list
+
+def fit_edges(edges,holdout,K,**params):
+	" Fit MultiTensor with K groups on edges held in memory and score it on the held-out edges, as sweep_K does for one K"
+	" INPUT 'edges' and 'holdout' are (sources,targets,weights) as returned by tools.read_edge_list"
+	" OUTPUT (max likelihood, summed AUC over the held-out layers, runtime in seconds) "
+	sources,targets,weights=edges
+	params['L']=weights.shape[1]
+	A,B,nodes,index=tl.build_adjacency(sources,targets,weights,undirected=params.get('undirected',False))
+	B,u_list,v_list=_prepare(A,B,params)
+	_,maxL,auc,dt=_fit_K(K,B,u_list,v_list,nodes,index,holdout,params)
+	return maxL,auc,dt
+
+_sweep={}
+
+def _init_sweep(args):
+	" Keep the data inherited from the parent in the worker's globals"
+	_sweep['args']=args
+
+def _fit_K_worker(K):
+	return _fit_K(K,*_sweep['args'])
+
+def sweep_K(folder,adj,holdout_file,K_list,L,jobs=1,**params):
+	" Fit MultiTensor for every K in K_list and score it on the held-out edges, without writing or parsing result files"
+	" The adjacency and the holdout are read once. With jobs>1 the K values are fitted over a process pool that"
+	" inherits the adjacency from shared memory. 'params' are passed to MultiTensor (N_real, maxit, sparse, ...)"
+	" OUTPUT dict K -> (max likelihood, summed AUC over layers, runtime in seconds) "
+	params['L']=L
+	A,B,nodes,index=tl.read_adjacency(folder,adj,L,undirected=params.get('undirected',False))
+	B,u_list,v_list=_prepare(A,B,params)
+	holdout=tl.read_edge_list(folder,holdout_file,L)
+
+	if(jobs>1 and len(K_list)>1):
+		params['jobs']=1  # workers can not start pools of their own
+		args=(tl.share_tensor(B),u_list,v_list,nodes,index,holdout,params)
+		pool=tl.start_pool(min(jobs,len(K_list)),_init_sweep,(args,))
+		results=tl.pool_map(pool,_fit_K_worker,K_list)
+	else:
+		results=[_fit_K(K,B,u_list,v_list,nodes,index,holdout,params) for K in K_list]
+
+	return dict((K,(maxL,auc,dt)) for K,maxL,auc,dt in results)
+
+def main():
+	p = ArgumentParser()
+	p.add_argument('-f', '--folder', type=str, default='')
+	p.add_argument('-a', '--adj', type=str, default='adjacency.dat')
+	p.add_argument('-H', '--holdout', type=str, default='holdout.dat')
+	p.add_argument('-l', '--L', type=int, default=4)
+	p.add_argument('-k', '--K', type=int, nargs='+', default=[2,3,4,5])
+	p.add_argument('-r', '--N_real', type=int, default=1)
+	p.add_argument('-t', '--maxit', type=int, default=500)
+	p.add_argument('-e', '--tolerance', type=float,default=0.1)
+	p.add_argument('-A','--assortative',type=int,default=0)
+	p.add_argument('-u','--undirected',type=int,default=0)
+	p.add_argument('-z', '--rseed', type=int, default=0)
+	p.add_argument('-y','--decision',type=int,default=2)
+	p.add_argument('-s','--sparse',type=int,default=0)
+	p.add_argument('-j','--jobs',type=int,default=1)
+	p.add_argument('-c','--check_every',type=int,default=10)
+	p.add_argument('-S','--squarem',type=int,default=0)
+	args = p.parse_args()
+
+	table=sweep_K("../data/"+args.folder,args.adj,args.holdout,args.K,args.L,jobs=args.jobs,
+			N_real=args.N_real,
+			maxit=args.maxit,
+			tolerance=args.tolerance,
+			decision=args.decision,
+			rseed=args.rseed,
+			err_max=0.0000001,
+			undirected=bool(args.undirected),
+			assortative=bool(args.assortative),
+			sparse=bool(args.sparse),
+			check_every=args.check_every,
+			squarem=bool(args.squarem)
+			)
+
+	print "K  Likelihood  AUC  time(s)"
+	for K in sorted(table):
+		print K,table[K][0],table[K][1],table[K][2]
+
+
+if __name__ == '__main__':
+	main()
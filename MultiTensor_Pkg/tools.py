@@ -2,96 +2,213 @@
 # -----------------------------------------------------------------
 #	Functions needed to perform different tasks inside the update routine
 # -----------------------------------------------------------------
-import networkx as nx
 import os
+import signal
+import struct
+import zipfile
 import numpy as np
+from scipy.sparse import csr_matrix, triu
+import multiprocessing as mp
+from multiprocessing.sharedctypes import RawArray
 
-def remove_zero_entries_v(A):
-	"INPUT:  Multilayer graph A"
-	"OUTPUT: list with INT INDECES of nodes having zero total in_degree over the all layers "
-	L=len(A)  # number of layers
-	zero_in=[]
-	for i in A[0].nodes():  # cycle over nodes
-		k=0 
-		for l in range(L):
-			if(type(A[l].in_degree(i))!=dict):k+=A[l].in_degree(i)	
-		if(k>0):zero_in.append(A[0].nodes().index(i))	
-	return zero_in	
-
-def remove_zero_entries_u(A):
-	"INPUT:  Multilayer graph A"
-	"OUTPUT: list with INT INDECES of nodes having zero total out_degree over the all layers "
-	L=len(A)  # number of layers
-	zero_out=[]
-	for i in A[0].nodes():  # cycle over nodes
-		k=0 
-		for l in range(L):
-			if(type(A[l].out_degree(i))!=dict):k+=A[l].out_degree(i)
-		if(k>0):zero_out.append(A[0].nodes().index(i))	
-	return zero_out
-
-def remove_zero_entries_undirected(A):
-	"INPUT:  Multilayer UNDIRECTED graph A"
-	"OUTPUT: list with INT INDECES of nodes having zero total degree over the all layers "
-	L=len(A)  # number of layers
-	zero_in=[]
-	for i in A[0].nodes():  # cycle over nodes
-		k=0 
-		for l in range(L):
-			if(type(A[l].degree(i))!=dict):k+=A[l].degree(i)
-			
-		if(k>0):zero_in.append(A[0].nodes().index(i))	
-	return zero_in	
-
-def idx(i,A):
-	" Adds node i to all layers"
-	" returns node index "
-	L=len(A)
-	if(i not in A[0].nodes()):
-		for l in range(L):A[l].add_node(i)
-	
-	#return A[0].nodes().index(i)
+def node_degrees(A):
+	"INPUT:  Multilayer adjacency A, list of L sparse N x N matrices"
+	"OUTPUT: out_degree and in_degree vectors of length N, summed over all layers"
+	S=A[0].copy()
+	for l in range(1,len(A)):S=S+A[l]
+	k_out=np.asarray(S.sum(axis=1)).ravel()
+	k_in=np.asarray(S.sum(axis=0)).ravel()
+	return k_out,k_in
+
+def remove_zero_entries_v(A,k_in=None):
+	"INPUT:  Multilayer adjacency A, list of L sparse N x N matrices; optionally its in_degree vector from node_degrees"
+	"OUTPUT: array with INT INDECES of nodes having nonzero total in_degree over the all layers "
+	if(k_in is None):k_in=node_degrees(A)[1]
+	return np.nonzero(k_in)[0]
+
+def remove_zero_entries_u(A,k_out=None):
+	"INPUT:  Multilayer adjacency A, list of L sparse N x N matrices; optionally its out_degree vector from node_degrees"
+	"OUTPUT: array with INT INDECES of nodes having nonzero total out_degree over the all layers "
+	if(k_out is None):k_out=node_degrees(A)[0]
+	return np.nonzero(k_out)[0]
 
-def read_graph(folder,adjacency_file,A):
+def remove_zero_entries_undirected(A,k=None):
+	"INPUT:  Multilayer UNDIRECTED adjacency A, list of L symmetric sparse N x N matrices; optionally its degree vector"
+	"OUTPUT: array with INT INDECES of nodes having nonzero total degree over the all layers "
+	return remove_zero_entries_u(A,k)
+
+def read_edge_list(folder,adjacency_file,L):
+	"INPUT:  edge list with rows 'E node1 node2 w1 .. wL', streamed line by line"
+	"OUTPUT: source and target label lists and the E x L INT weight array, one row per edge row of the file"
 	assert(os.path.isfile(os.path.join(folder, adjacency_file)) and os.access(os.path.join(folder, adjacency_file), os.R_OK))
-   	infile=open(os.path.join(folder, adjacency_file),'r');
-   	nr=0
-   	L=len(A)
-   	for line in infile:
-   		a=line.strip('\n').split()
-   		if(a[0]=="E"):  # Flag to check the entry is an edge
-	   		if(nr==0): # check format file is ok
-	   			l=len(a)-3
-	   			assert(l==L)
-	   		v1=a[1]
-	   		v2=a[2]
-	   		idx(v1,A)
-	   		idx(v2,A)
-	   		for l in range(L):
-	   			is_edge=int(a[l+3])
-	   			if(is_edge>0):A[l].add_edge(v1, v2, weight=is_edge)
-	infile.close()   			
+	sources=[]
+	targets=[]
+	weights=[]
+	infile=open(os.path.join(folder, adjacency_file),'r')
+	for line in infile:
+		a=line.split()
+		if(len(a)>0 and a[0]=="E"):  # Flag to check the entry is an edge
+			assert(len(a)-3==L)   # check format file is ok
+			sources.append(a[1])
+			targets.append(a[2])
+			weights.extend(a[3:])
+	infile.close()
+	return sources,targets,np.array(weights,dtype=np.int64).reshape(len(sources),L)
+
+def read_adjacency(folder,adjacency_file,L,undirected=False):
+	"INPUT:  edge list with rows 'E node1 node2 w1 .. wL', streamed line by line"
+	"OUTPUT: A: list of L csr_matrix N x N, one per layer (symmetric if undirected), repeated edges are summed"
+	"        B: (subs,data) nonzero entries sorted by layer, as returned by sparse_entries"
+	"        nodes: node labels in order of first appearance, node i has label nodes[i]"
+	"        index: dict label -> INT INDEX"
+	sources,targets,weights=read_edge_list(folder,adjacency_file,L)
+	return build_adjacency(sources,targets,weights,undirected=undirected)
+
+def build_adjacency(sources,targets,weights,undirected=False):
+	"INPUT:  source and target label lists and the E x L weight array of the edges, as returned by read_edge_list"
+	"OUTPUT: A, B, nodes and index as returned by read_adjacency, built in memory without an adjacency file"
+	L=weights.shape[1]
+	nodes=[]
+	index={}
+	for e in zip(sources,targets):
+		for v in e:
+			if(v not in index):
+				index[v]=len(nodes)
+				nodes.append(v)
+	source=np.array([index[v] for v in sources],dtype=np.int64)
+	target=np.array([index[v] for v in targets],dtype=np.int64)
+
+	N=len(nodes)
+	edge,layer=np.nonzero(weights>0)
+	i=source[edge];j=target[edge];w=weights[edge,layer].astype(float)
+	if(undirected==True):  # mirror the off-diagonal entries
+		off=i!=j
+		i,j=np.concatenate((i,j[off])),np.concatenate((j,i[off]))
+		w=np.concatenate((w,w[off]))
+		layer=np.concatenate((layer,layer[off]))
+
+	A=[]
+	subs=([],[],[])
+	data=[]
+	for l in range(L):
+		in_layer=layer==l
+		A.append(csr_matrix((w[in_layer],(i[in_layer],j[in_layer])),shape=(N,N)))  # sums duplicates
+		c=A[l].tocoo()
+		subs[0].append(np.full(c.nnz,l,dtype=np.int64))
+		subs[1].append(c.row.astype(np.int64))
+		subs[2].append(c.col.astype(np.int64))
+		data.append(c.data)
+	B=tuple(np.concatenate(s) for s in subs),np.concatenate(data)
+
+	return A,B,nodes,index
+
+def dense_tensor(A):
+	"INPUT:  Multilayer adjacency A, list of L sparse N x N matrices"
+	"OUTPUT: dense adjacency tensor B of shape L x N x N"
+	L=len(A);N=A[0].shape[0]
+	B=np.empty(shape=[L,N,N])
+	for l in range(L):B[l,:,:]=A[l].toarray()
+	return B
+
+def sparse_entries(B):
+	"INPUT:  dense adjacency tensor B of shape L x N x N"
+	"OUTPUT: tuple (subs,data): subs=(layer,source,target) INT INDECES of the nonzero entries, sorted by layer, and data their weights"
+	subs=np.nonzero(B)
+	return subs,B[subs]
+
+def shared_array(x):
+	"INPUT:  numpy array x"
+	"OUTPUT: read-only copy of x backed by shared memory, visible without copies to processes forked afterwards"
+	buf=RawArray('b',max(x.nbytes,1))
+	y=np.frombuffer(buf,dtype=x.dtype,count=x.size).reshape(x.shape)
+	y[...]=x
+	y.flags.writeable=False
+	return y
+
+def share_tensor(B):
+	"INPUT:  adjacency tensor B, either dense L x N x N or the (subs,data) tuple of sparse_entries"
+	"OUTPUT: the same tensor with every array moved to shared memory"
+	if(isinstance(B,np.ndarray)):return shared_array(B)
+	subs,data=B
+	return tuple(shared_array(s) for s in subs),shared_array(data)
 
 def print_graph_stat(A):
-	L=len(A);N=A[0].number_of_nodes()
+	L=len(A);N=A[0].shape[0]
 	print "N=",N
 	for l in range(L):
-		B=nx.to_numpy_matrix(A[l],weight='weight')
-		E=np.sum(B)
+		E=A[l].sum()
 		print 'E[',l,']=',E," density=",100*float(E)/float(N*(N-1))
 
-def out_graph(folder,A):
+def out_graph(folder,A,nodes,undirected=False):
 	L=len(A)
 	for a in range(L):
 		outfile=os.path.join(folder, "out_adjacency_"+str(a)+".dat")
 		outf=open(outfile,'w')
 		print "Adjacency of layer ",a," output in: ",outfile
-		for e in A[a].edges():
-			i=e[0]
-			j=e[1]
-			print >> outf,i,j
+		if(undirected==True):c=triu(A[a]).tocoo()  # each edge once
+		else:c=A[a].tocoo()
+		for i,j in zip(c.row,c.col):
+			print >> outf,nodes[i],nodes[j]
 		outf.close()
 		
+def save_results(outfile,u,v,w,nodes,maxL,**params):
+	"Write u, v, w, the node labels, the max likelihood and the run parameters 'params' to one uncompressed .npz"
+	np.savez(outfile,u=u,v=v,w=w,nodes=np.array(nodes),maxL=maxL,**params)
+
+def results_file(folder,K_end_file):
+	"Name of the .npz written by save_results for a run with file ending K_end_file=str(K)+end_file, a trailing .dat is dropped"
+	"e.g. K_end_file='4.dat' -> folder/uvw_K4.npz, '3_1_2.dat' -> folder/uvw_K3_1_2.npz"
+	if(K_end_file.endswith('.dat')):K_end_file=K_end_file[:-len('.dat')]
+	return os.path.join(folder,"uvw_K"+K_end_file+".npz")
+
+def load_results(infile):
+	"INPUT:  .npz written by save_results"
+	"OUTPUT: dict name -> array. Arrays are memory-mapped read-only in place inside the .npz, without copies"
+	out={}
+	z=zipfile.ZipFile(infile)
+	f=open(infile,'rb')
+	for info in z.infolist():
+		name=info.filename[:-4]  # strip .npy
+		if(info.compress_type!=zipfile.ZIP_STORED):
+			out[name]=np.lib.format.read_array(z.open(info))
+			continue
+		f.seek(info.header_offset)
+		n,m=struct.unpack('<HH',f.read(30)[26:30])  # file name and extra field lengths of the local header
+		f.seek(info.header_offset+30+n+m)
+		version=np.lib.format.read_magic(f)
+		if(version==(1,0)):shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+		else:shape,fortran,dtype=np.lib.format.read_array_header_2_0(f)
+		if(dtype.hasobject or len(shape)==0 or np.prod(shape)==0):
+			f.seek(info.header_offset+30+n+m)
+			out[name]=np.lib.format.read_array(f)
+		else:
+			out[name]=np.memmap(infile,dtype=dtype,mode='r',offset=f.tell(),shape=shape,order='F' if fortran else 'C')
+	f.close()
+	z.close()
+	return out
+
+def _init_pool_worker(initializer,initargs):
+	signal.signal(signal.SIGINT,signal.SIG_IGN)  # Ctrl-C is handled by the parent, which terminates the pool
+	if(initializer is not None):initializer(*initargs)
+
+def start_pool(processes,initializer=None,initargs=()):
+	"mp.Pool whose workers ignore Ctrl-C, see pool_map"
+	return mp.Pool(processes=processes,initializer=_init_pool_worker,initargs=(initializer,initargs))
+
+def pool_map(pool,func,tasks,chunksize=None):
+	"pool.map that Ctrl-C interrupts: the wait has a timeout because Python 2 does not deliver KeyboardInterrupt to a wait without one"
+	"On any exception the workers are terminated and the exception raised again, otherwise the pool is closed. The pool is always joined"
+	try:
+		results=pool.map_async(func,tasks,chunksize).get(1e9)
+	except BaseException:
+		pool.terminate()
+		raise
+	else:
+		pool.close()
+	finally:
+		pool.join()
+	return results
+
 def can_cast(string):
     try:
         int(string)
@@ -40,11 +40,14 @@
 
 
 
-import sys, csv
+import sys, csv, signal
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 import math 
 import numpy as np
+import pandas as pd
 from scipy.sparse import csr_matrix, eye
-from scipy.linalg import eigh, eig
+from scipy.linalg import eigh, eig, eigh_tridiagonal
 import copy
 from scipy.cluster.hierarchy import linkage, dendrogram
 
@@ -77,8 +80,162 @@ class XLogx_fit:
             sys.exit(-1)
 
 
+class SLQ_entropy:
+    ### Estimates the Von Neumann entropy -tr(rho log rho) of a rescaled
+    ### Laplacian by stochastic Lanczos quadrature, using only sparse
+    ### matrix-vector products. Each of the 'probes' Rademacher vectors z
+    ### gives z' f(rho) z from a 'steps'-point Lanczos quadrature, and
+    ### their average is a Hutchinson estimate of the trace. More probes
+    ### reduce the variance, more steps the quadrature error. The probes
+    ### are drawn from 'seed' at every call, so the same matrix always
+    ### gives the same estimate.
+    def __init__(self, probes=30, steps=30, seed=0):
+        self.probes = probes
+        self.steps = steps
+        self.seed = seed
+
+    def __call__(self, resc_laplacian):
+        N = resc_laplacian.shape[0]
+        rng = np.random.RandomState(self.seed)
+        h = 0
+        for p in range(self.probes):
+            z = rng.randint(0, 2, N) * 2.0 - 1.0
+            alpha, beta = self.__lanczos(resc_laplacian, z)
+            theta, U = eigh_tridiagonal(alpha, beta)
+            keep = theta > 10e-20
+            h -= N * np.sum(U[0, keep]**2 * theta[keep] * np.log(theta[keep]))
+        return h / self.probes
+
+    def __lanczos(self, A, z):
+        ### Tridiagonal Lanczos matrix of A started from z, with full
+        ### reorthogonalization of the Krylov basis
+        m = min(self.steps, A.shape[0])
+        V = np.zeros((m, A.shape[0]))
+        alpha = np.zeros(m)
+        beta = np.zeros(m)
+        V[0] = z / np.linalg.norm(z)
+        for k in range(m):
+            w = A.dot(V[k])
+            alpha[k] = w.dot(V[k])
+            w -= V[:k+1].T.dot(V[:k+1].dot(w))
+            if k == m - 1:
+                break
+            beta[k] = np.linalg.norm(w)
+            if beta[k] < 1e-12:
+                ### The Krylov space is exhausted, the quadrature is exact
+                m = k + 1
+                break
+            V[k+1] = w / beta[k]
+        return alpha[:m], beta[:m-1]
+
+
+def _block_traces(A, Z, p):
+    ### Sum over the columns z of Z of z' A^k z, for k = 1..p and A
+    ### symmetric. Only the products A^j Z up to j = (p+1)/2 are needed,
+    ### since z' A^k z = (A^(k/2) z)' (A^(k-k/2) z)
+    W = [Z]
+    for j in range(1, (p+1)//2 + 1):
+        W.append(A.dot(W[-1]))
+    return np.array([np.sum(W[k//2] * W[k - k//2]) for k in range(1, p+1)])
+
+def power_traces(A, p, probes=None, seed=0, block=256):
+    ### tr(A^k) for k = 1..p of a symmetric sparse matrix A, from sparse
+    ### matrix times dense block products only: the powers of A, which
+    ### fill in towards dense, are never formed. The exact traces take
+    ### the unit vectors as z in _block_traces, 'block' of them at a time.
+    ### With 'probes' they are estimated as the mean of z' A^k z over
+    ### Rademacher vectors z drawn from 'seed' instead
+    N = A.shape[0]
+    if probes:
+        rng = np.random.RandomState(seed)
+        Z = (rng.randint(0, 2, (probes, N)) * 2.0 - 1.0).T
+        return _block_traces(A, Z, p) / probes
+    traces = np.zeros(p)
+    for i in range(0, N, block):
+        Z = np.zeros((N, min(block, N - i)))
+        Z[np.arange(i, i + Z.shape[1]), np.arange(Z.shape[1])] = 1.0
+        traces += _block_traces(A, Z, p)
+    return traces
+
+
+def read_edge_file(layerfile):
+    ### Edges of a layer file with lines 'i j [w]', parsed in one go by
+    ### the C parser of pandas, which releases the GIL while tokenizing so
+    ### several files load in parallel on threads. Returns the int32
+    ### arrays i and j and the float64 weights (1 if the file has no
+    ### weight column)
+    try:
+        e = pd.read_csv(layerfile, delim_whitespace=True, comment='#', header=None).values
+    except pd.errors.EmptyDataError:
+        e = np.zeros((0, 2))
+    ii = e[:, 0].astype(np.int32)
+    jj = e[:, 1].astype(np.int32)
+    if e.shape[1] > 2: ## A weight is specified
+        ww = e[:, 2].astype(np.float64)
+    else:
+        ww = np.ones(len(e))
+    return ii, jj, ww
+
+def read_multitensor_file(multilayerfile):
+    ### Layers of a single edge list in the MultiTensor format
+    ### 'E node1 node2 w1 .. wL'. Node labels are numbered in order of
+    ### first appearance, layer l has the edges with nonzero w_l.
+    ### Returns the list of (i, j, w) arrays of each layer and the labels
+    rows = pd.read_csv(multilayerfile, delim_whitespace=True, comment='#', header=None,
+                       dtype={0: str, 1: str, 2: str})
+    rows = rows[rows[0] == 'E']
+    ends, labels = pd.factorize(rows[[1, 2]].values.ravel())
+    ends = ends.astype(np.int32).reshape(-1, 2)
+    weights = rows.iloc[:, 3:].values.astype(np.float64)
+    edges = []
+    for l in range(weights.shape[1]):
+        e = np.nonzero(weights[:, l])[0]
+        edges.append((ends[e, 0], ends[e, 1], weights[e, l]))
+    return edges, list(labels)
+
+
+class csr_pattern:
+    ### Union CSR sparsity pattern of a set of N x N adjacency matrices,
+    ### diagonal included. A matrix on the pattern is only its data array:
+    ### sums and mixtures of layers are sums of data arrays, and the
+    ### Laplacians share the indices of the pattern
+    def __init__(self, matrices, N):
+        pattern = csr_matrix(eye(N, format='csr'))
+        for A in matrices:
+            pattern = pattern + abs(A)
+        pattern.sort_indices()
+        self.N = N
+        self.indptr = pattern.indptr
+        self.indices = pattern.indices
+        self._keys = self.__keys(pattern)
+        self.diag = np.searchsorted(self._keys, np.arange(N, dtype=np.int64) * (N + 1))
+
+    def __keys(self, A):
+        rows = np.repeat(np.arange(A.shape[0], dtype=np.int64), np.diff(A.indptr))
+        return rows * self.N + A.indices
+
+    def data(self, A):
+        ### Entries of A, whose nonzeros must lie in the pattern, as a data array
+        A = csr_matrix(A, copy=True)
+        A.sum_duplicates()
+        A.eliminate_zeros()
+        a = np.zeros(len(self.indices))
+        a[np.searchsorted(self._keys, self.__keys(A))] = A.data
+        return a
+
+    def matrix(self, a):
+        return csr_matrix((a, self.indices, self.indptr), shape=(self.N, self.N))
+
+    def laplacians(self, a):
+        ### Laplacian D - A and rescaled Laplacian (D - A)/tr(D - A) of the
+        ### adjacency with data a, computed on the data array
+        lap = -a
+        lap[self.diag] += np.bincount(self.indices, weights=a, minlength=self.N)
+        return self.matrix(lap), self.matrix(lap / lap[self.diag].sum())
+
+
 class layer:
-    def __init__ (self, layerfile= None, matrix=None):
+    def __init__ (self, layerfile= None, matrix=None, edges=None, pattern=None, adj_data=None):
         self.N = 0
         self.num_layer = -1
         self.fname = layerfile
@@ -90,71 +247,63 @@ class layer:
         self._ii = []
         self._jj = []
         self._ww = []
+        self.pattern = None
+        self.adj_data = None
         self._matrix_called = False
-        if layerfile != None:
+        if layerfile is not None:
             try:
-                min_N = 10e10
-                with open(layerfile, "r") as lines:
-                    for l in lines:
-                        if l[0] == '#':
-                            continue
-                        elems = l.strip(" \n").split(" ")
-                        s = int(elems[0])
-                        d = int(elems[1])
-                        self._ii.append(s)
-                        self._jj.append(d)
-                        #if s > self.N:
-                        #    self.N = s
-                        #if d > self.N:
-                        #    self.N = d
-                        if s < min_N:
-                            min_N = s
-                        if  d < min_N:
-                            min_N = d
-                        if len(elems) >2 : ## A weight is specified 
-                            val = [float(x) if "e" in x or "." in x else int(x) for x in [elems[2]]][0]
-                            self._ww.append(float(val))
-                        else:
-                            self._ww.append(int(1))
-                m1 = max(self._ii)
-                m2 = max(self._jj)
-                if m1 > m2:
-                    self.N = m1
-                else:
-                    self.N = m2
-                
+                edges = read_edge_file(layerfile)
             except (IOError):
                 print "Unable to find/open file %s -- Exiting!!!" % layerfile
                 sys.exit(-2)
-        elif matrix != None:
-            self.adj_matr = copy.copy(matrix)
+        if edges is not None:
+            ### Edges (i, j, w) already parsed, see read_edge_file
+            self._ii, self._jj, self._ww = edges
+            if len(self._ii) > 0:
+                self.N = int(max(self._ii.max(), self._jj.max()))
+        elif adj_data is not None:
+            ### Adjacency given by its data array on a shared csr_pattern
+            self.N = pattern.N
+            self.set_adjacency(adj_data, pattern)
+        elif matrix is not None:
             self.N, _x = matrix.shape 
-            K = self.adj_matr.sum(0).reshape((1, self.N)).tolist()[0]
-            D = csr_matrix((K, (range(self.N), range(self.N)) ), shape=(self.N, self.N))
-            self.laplacian = csr_matrix(D - self.adj_matr)
-            K = self.laplacian.diagonal().sum()
-            self.resc_laplacian = csr_matrix(self.laplacian / K)
-            self._matrix_called = True
+            pattern = csr_pattern([matrix], self.N)
+            self.set_adjacency(pattern.data(matrix), pattern)
         else:
             print "The given matrix is BLANK"
-    def make_matrices(self, N):
+    def edge_matrix(self, N):
+        ### Symmetrized N x N adjacency matrix of the edges of the layer
+        A = csr_matrix((self._ww, (self._ii, self._jj)), shape=(N, N))
+        return A + A.transpose()
+
+    def make_matrices(self, N, pattern=None):
+        ### With a csr_pattern shared by several layers, the matrices of
+        ### this layer use its indices
         self.N = N 
-        self.adj_matr = csr_matrix((self._ww, (self._ii, self._jj)), shape=(self.N, self.N))
-        self.adj_matr = self.adj_matr + self.adj_matr.transpose()
-        K = self.adj_matr.sum(0).reshape((1, self.N)).tolist()[0]
-        D = csr_matrix((K, (range(self.N), range(self.N)) ), shape=(self.N, self.N))
-        self.laplacian = csr_matrix(D - self.adj_matr)
-        K = self.laplacian.diagonal().sum()
-        self.resc_laplacian = csr_matrix(self.laplacian / K)
+        A = self.edge_matrix(N)
+        if pattern is None:
+            pattern = csr_pattern([A], N)
+        self.set_adjacency(pattern.data(A), pattern)
+
+    def set_adjacency(self, adj_data, pattern):
+        self.pattern = pattern
+        self.adj_data = adj_data
+        self.adj_matr = pattern.matrix(adj_data)
+        self.laplacian, self.resc_laplacian = pattern.laplacians(adj_data)
         self._matrix_called = True
 
     def dump_info(self):
         N, M = self.adj_matr.shape
-        K = self.adj_matr.nnz
+        K = np.count_nonzero(self.adj_data)
         sys.stderr.write("Layer File: %s\nNodes: %d Edges: %d\nEntropy: %g Approx. Entropy: %g\n" % \
                              (self.fname, N, K, self.entropy, self.entropy_approx) )
 
-    def compute_VN_entropy(self):
+    def compute_VN_entropy(self, slq=None):
+        ### With an SLQ_entropy estimator the dense eigendecomposition is
+        ### replaced by sparse matrix-vector products
+        if slq is not None:
+            self.entropy = slq(self.resc_laplacian)
+            return
         eigvals = eigh(self.resc_laplacian.todense())
 
         self.entropy = 0
@@ -163,36 +312,90 @@ class layer:
                 self.entropy -= l_i * math.log (l_i)
 
 
-    def compute_VN_entropy_approx(self, poly):
+    def compute_VN_entropy_approx(self, poly, probes=None, seed=0):
+        ### -tr(poly(rho)) from the traces of the powers of rho. With
+        ### 'probes' the traces are Hutchinson estimates from Rademacher
+        ### vectors drawn from 'seed', using only matrix-vector products
         p = poly.degree
         h = - poly[p] * self.N
-        M = csr_matrix(eye(self.N))
-        for i in range(p-1, -1, -1):
-            M = M *  self.resc_laplacian
-            h += - poly[i] * sum(M.diagonal())
+        traces = power_traces(self.resc_laplacian, p, probes, seed)
+        for k in range(1, p+1):
+            h += - poly[p-k] * traces[k-1]
         self.entropy_approx = h
 
     def aggregate(self, other_layer):
-        if self.adj_matr != None:
-            self.adj_matr = self.adj_matr + other_layer.adj_matr
+        if self.adj_matr is None:
+            self.set_adjacency(other_layer.adj_data.copy(), other_layer.pattern)
+        elif self.pattern is other_layer.pattern:
+            self.set_adjacency(self.adj_data + other_layer.adj_data, self.pattern)
         else:
-            self.adj_matr = copy.copy(other_layer.adj_matr)
-        K = self.adj_matr.sum(0).reshape((1, self.N)).tolist()[0]
-        D = csr_matrix((K, (range(self.N), range(self.N)) ), shape=(self.N, self.N))
-        self.laplacian = csr_matrix(D - self.adj_matr)
-        K = self.laplacian.diagonal().sum()
-        self.resc_laplacian = csr_matrix(self.laplacian / K)
-        self._matrix_called = True
+            pattern = csr_pattern([self.adj_matr, other_layer.adj_matr], self.N)
+            self.set_adjacency(pattern.data(self.adj_matr) + pattern.data(other_layer.adj_matr), pattern)
 
     def dump_laplacian(self):
         print self.laplacian
 
+def pool_map(pool, func, tasks):
+    ### pool.map that Ctrl-C interrupts: Python 2 only delivers a
+    ### KeyboardInterrupt to a wait with a timeout. On any exception the
+    ### workers are terminated and the exception raised again
+    try:
+        results = pool.map_async(func, tasks).get(1e9)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return results
+
+_worker = {}
+
+def _init_pool_worker(*args):
+    ### Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(*args)
+
+def _init_worker(pattern, adj_data, approx, poly, slq, approx_probes, approx_seed):
+    _worker['pattern'] = pattern
+    _worker['adj_data'] = adj_data
+    _worker['approx'] = approx
+    _worker['poly'] = poly
+    _worker['slq'] = slq
+    _worker['approx_probes'] = approx_probes
+    _worker['approx_seed'] = approx_seed
+
+def _mixture_entropy(idx):
+    m_sigma_data = _worker['adj_data'][idx[0]]
+    for k in idx[1:]:
+        m_sigma_data = m_sigma_data + _worker['adj_data'][k]
+    m_sigma = layer(pattern=_worker['pattern'], adj_data=m_sigma_data / float(len(idx)))
+    if _worker['approx']:
+        m_sigma.compute_VN_entropy_approx(_worker['poly'], _worker['approx_probes'], _worker['approx_seed'])
+        return m_sigma.entropy_approx
+    m_sigma.compute_VN_entropy(_worker['slq'])
+    return m_sigma.entropy
+
+
 class multiplex_red:
     
-    def __init__ (self, multiplexfile, directed = None, fit_degree=10, verbose=False):
+    def __init__ (self, multiplexfile, directed = None, fit_degree=10, verbose=False, slq=None, jobs=1,
+                  approx_probes=None, approx_seed=0, multitensor=False, loader_threads=4):
+        ### slq: an SLQ_entropy estimator to use instead of the exact
+        ### (dense) Von Neumann entropy, for networks too large for eigh
+        ### jobs: number of processes computing the JSD matrix
+        ### approx_probes, approx_seed: estimate the traces of the approx
+        ### entropies stochastically, see power_traces
+        ### multitensor: multiplexfile is a single MultiTensor edge list
+        ### 'E node1 node2 w1 .. wL' instead of a list of layer files, the
+        ### node labels are then kept in self.nodes
+        ### loader_threads: number of layer files read at the same time
         self.layers = []
         self.N = 0
         self.M = 0
+        self.nodes = None
+        self.pattern = None
         self.entropy = 0
         self.entropy_approx = 0
         self.JSD = None
@@ -203,29 +406,44 @@ class multiplex_red:
         self.q_vals = None
         self.q_vals_approx = None
         self.fit_degree = fit_degree
+        self.slq = slq
+        self.jobs = jobs
+        self.approx_probes = approx_probes
+        self.approx_seed = approx_seed
+        self.pair_entropy = {}
+        self.pair_entropy_approx = {}
         self.poly = XLogx_fit(self.fit_degree)
         self.verb = verbose
         self.cuts = None
         self.cuts_approx = None
         try:
-            for l in csv.reader(open(multiplexfile, 'r')):
-                l = l[0]
+            if multitensor:
+                edges, self.nodes = read_multitensor_file(multiplexfile)
+                fnames = ["%s:%d" % (multiplexfile, l) for l in range(len(edges))]
+            else:
+                fnames = [l[0] for l in csv.reader(open(multiplexfile, 'r')) if l]
                 if (self.verb):
-                    sys.stderr.write("Loading layer %d from file %s" % (len(self.layers), l))
-                A = layer(l)
-                #if A.N > self.N:
-                #    self.N = A.N+1
+                    for n, l in enumerate(fnames):
+                        sys.stderr.write("Loading layer %d from file %s\n" % (n, l))
+                ### The layer files are read concurrently
+                pool = ThreadPool(processes=max(1, min(loader_threads, len(fnames))))
+                edges = pool_map(pool, read_edge_file, fnames)
+            for l, e in zip(fnames, edges):
+                A = layer(edges=e)
+                A.fname = l
                 self.layers.append(A)
-            n = 0
             N = max([x.N for x in self.layers])
             self.N = N + 1
-            for l in self.layers:
-                l.make_matrices(self.N)
+            ### All the layers, and so their mixtures, share one pattern
+            adj = [l.edge_matrix(self.N) for l in self.layers]
+            self.pattern = csr_pattern(adj, self.N)
+            for n, (l, A) in enumerate(zip(self.layers, adj)):
+                l.N = self.N
+                l.set_adjacency(self.pattern.data(A), self.pattern)
                 l.num_layer = n
-                n += 1
             self.M = len(self.layers)
         except ( IOError):
-            print "Unable to find/open file %s -- Exiting!!!" % layer_file
+            print "Unable to find/open file %s or its layer files -- Exiting!!!" % multiplexfile
             sys.exit(-2)
 
     def dump_info(self):
@@ -237,80 +455,84 @@ class multiplex_red:
 
 
     def compute_aggregated(self):
-        self.aggr = copy.copy(self.layers[0])
-        self.aggr.entropy = 0
-        self.aggr.entropy_approx = 0
-        for l in self.layers[1:]:
-            self.aggr.aggregate(l)
+        self.aggr = layer(pattern=self.pattern, adj_data=sum([l.adj_data for l in self.layers]))
 
     def compute_layer_entropies(self):
         for l in self.layers:
-            l.compute_VN_entropy()
+            l.compute_VN_entropy(self.slq)
 
     def compute_layer_entropies_approx(self):
         for l in self.layers:
-            l.compute_VN_entropy_approx(self.poly)
+            l.compute_VN_entropy_approx(self.poly, self.approx_probes, self.approx_seed)
+
 
+    def layer_entropy(self, l, approx=False):
+        ### Entropy of layer l, computed only the first time. None is the
+        ### sentinel for an entropy not computed yet, 0 is a valid entropy
+        if approx:
+            if l.entropy_approx is None:
+                l.compute_VN_entropy_approx(self.poly, self.approx_probes, self.approx_seed)
+            return l.entropy_approx
+        if l.entropy is None:
+            l.compute_VN_entropy(self.slq)
+        return l.entropy
 
     def compute_multiplex_entropy(self, force_compute=False):
         ### The entropy of a multiplex is defined as the sum of the entropies of its layers
-        for l in self.layers:
-            if l.entropy == None:
-                l.compute_VN_entropy()
-                self.entropy += l.entropy
+        self.entropy = sum([self.layer_entropy(l) for l in self.layers])
 
     def compute_multiplex_entropy_approx(self, force_compute=False):
         ### The entropy of a multiplex is defined as the sum of the entropies of its layers
-        for l in self.layers:
-            if l.entropy_approx == None:
-                l.compute_VN_entropy_approx(self.poly)
-            self.entropy_approx += l.entropy_approx
+        self.entropy_approx = sum([self.layer_entropy(l, True) for l in self.layers])
+
+    def __mixture_entropies(self, tasks, approx):
+        ### Entropies of the mixtures (A_i + A_j + ...)/n of the layers
+        ### listed in each task, over a pool of self.jobs processes. The
+        ### workers inherit the pattern and the data arrays of the layers
+        ### when they are forked, each task only sends the layer indices
+        args = (self.pattern, [l.adj_data for l in self.layers], approx, self.poly, self.slq,
+                self.approx_probes, self.approx_seed)
+        if self.jobs > 1 and len(tasks) > 1:
+            pool = mp.Pool(processes=self.jobs, initializer=_init_pool_worker, initargs=args)
+            return pool_map(pool, _mixture_entropy, tasks)
+        _init_worker(*args)
+        return [_mixture_entropy(t) for t in tasks]
+
+    def __compute_JSD(self, approx):
+        ### Layer and pair entropies already computed are kept across calls
+        if approx:
+            attr, pair_entropy = "entropy_approx", self.pair_entropy_approx
+        else:
+            attr, pair_entropy = "entropy", self.pair_entropy
+        tasks = [(i,) for i in range(self.M) if getattr(self.layers[i], attr) is None]
+        tasks += [(i, j) for i in range(self.M) for j in range(i+1, self.M) \
+                      if (i, j) not in pair_entropy]
+        for t, h in zip(tasks, self.__mixture_entropies(tasks, approx)):
+            if len(t) == 1:
+                setattr(self.layers[t[0]], attr, h)
+            else:
+                pair_entropy[t] = h
+        JSD = np.zeros((self.M, self.M))
+        for (i, j), h in pair_entropy.items():
+            d = h - 0.5 * (getattr(self.layers[i], attr) + getattr(self.layers[j], attr))
+            ### An estimated entropy may give a slightly negative d
+            d = math.sqrt(max(d, 0))
+            JSD[i][j] = d
+            JSD[j][i] = d
+        return JSD
 
     def compute_JSD_matrix(self):
         if (self.verb):
             sys.stderr.write("Computing JSD matrix\n")
-        self.JSD = np.zeros((self.M, self.M))
-        for i in range(len(self.layers)):
-            for j in range(i+1, len(self.layers)):
-                li = self.layers[i]
-                lj = self.layers[j]
-                if not li.entropy:
-                    li.compute_VN_entropy()
-                if not lj.entropy:
-                    lj.compute_VN_entropy()
-                # m_sigma = (li.resc_laplacian + lj.resc_laplacian)/2.0
-                # m_sigma_entropy = mr.compute_VN_entropy_LR(m_sigma)
-                m_sigma_matr = (li.adj_matr + lj.adj_matr)/2.0
-                m_sigma = layer(matrix=m_sigma_matr)
-                m_sigma.compute_VN_entropy()
-                d = m_sigma.entropy - 0.5 * (li.entropy + lj.entropy)
-                d = math.sqrt(d)
-                self.JSD[i][j] = d
-                self.JSD[j][i] = d
-        pass
+        self.JSD = self.__compute_JSD(False)
 
     def compute_JSD_matrix_approx(self):
         if (self.verb):
             sys.stderr.write("Computing JSD matrix (approx)\n")
-        self.JSD_approx = np.zeros((self.M, self.M))
-        for i in range(len(self.layers)):
-            for j in range(i+1, len(self.layers)):
-                li = self.layers[i]
-                lj = self.layers[j]
-                if not li.entropy_approx:
-                    li.compute_VN_entropy_approx(self.poly)
-                if not lj.entropy_approx:
-                    lj.compute_VN_entropy_approx(self.poly)
-                m_sigma_matr = (li.adj_matr + lj.adj_matr)/2.0
-                m_sigma = layer(matrix=m_sigma_matr)
-                m_sigma.compute_VN_entropy_approx(self.poly)
-                d = m_sigma.entropy_approx - 0.5 * (li.entropy_approx + lj.entropy_approx)
-                d = math.sqrt(d)
-                self.JSD_approx[i][j] = d
-                self.JSD_approx[j][i] = d
-                
+        self.JSD_approx = self.__compute_JSD(True)
+
     def dump_JSD(self, force_compute=False):
-        if self.JSD == None:
+        if self.JSD is None:
             if force_compute:
                 self.compute_JSD_matrix()
             else:
@@ -323,7 +545,7 @@ class multiplex_red:
                 idx += 1
 
     def dump_JSD_approx(self, force_compute=False):
-        if self.JSD_approx == None:
+        if self.JSD_approx is None:
             if force_compute:
                 self.compute_JSD_matrix_approx()
             else:
@@ -339,7 +561,7 @@ class multiplex_red:
     def reduce(self, method="ward"):
         if (self.verb):
             sys.stderr.write("Performing '%s' reduction\n" % method)
-        if self.JSD == None:
+        if self.JSD is None:
             self.compute_JSD_matrix()
         self.Z = linkage(self.JSD, method=method)
         return self.Z
@@ -347,7 +569,7 @@ class multiplex_red:
     def reduce_approx(self, method="ward"):
         if (self.verb):
             sys.stderr.write("Performing '%s' reduction (approx)\n" % method)
-        if self.JSD_approx == None:
+        if self.JSD_approx is None:
             self.compute_JSD_matrix_approx()
         self.Z_approx = linkage(self.JSD_approx, method=method)
         return self.Z_approx
@@ -358,86 +580,50 @@ class multiplex_red:
     def get_linkage_approx(self):
         return self.Z_approx
 
-    def __compute_q(self, layers):
-        H_avg = 0
-        if not self.aggr:
+    def __q_profile(self, Z, approx):
+        ### q after each merge of the linkage Z, 1 - <H>/H_aggr where <H>
+        ### is the mean entropy of the remaining layers. The sum of their
+        ### entropies is updated at each merge, so only the entropy of the
+        ### newly merged layer is computed
+        if self.aggr is None:
             self.compute_aggregated()
-            self.aggr.compute_VN_entropy()
-        for l in layers:
-            if not l.entropy:
-                l.compute_VN_entropy()
-            H_avg += l.entropy
-        H_avg /= len(layers)
-        q = 1.0 - H_avg / self.aggr.entropy
-        return q
-
-    def get_q_profile(self):
+        H_aggr = self.layer_entropy(self.aggr, approx)
         mylayers = copy.copy(self.layers)
-        rem_layers = copy.copy(self.layers)
-        q_vals = []
-        if self.Z == None:
-            self.reduce()
-        q = self.__compute_q(rem_layers)
-        q_vals.append(q)
-        n = len(self.layers)
-        for l1, l2, _d, _x in self.Z:
-            l_new = layer(matrix=mylayers[int(l1)].adj_matr)
-            l_new.num_layer = n 
-            n += 1 
-            l_new.aggregate(mylayers[int(l2)])
-            rem_layers.remove(mylayers[int(l1)])
-            rem_layers.remove(mylayers[int(l2)])
-            rem_layers.append(l_new)
+        H = [self.layer_entropy(l, approx) for l in mylayers]
+        H_sum = sum(H)
+        n_rem = len(mylayers)
+        q_vals = [1.0 - H_sum / n_rem / H_aggr]
+        for l1, l2, _d, _x in Z:
+            l1 = int(l1)
+            l2 = int(l2)
+            l_new = layer(pattern=self.pattern,
+                          adj_data=mylayers[l1].adj_data + mylayers[l2].adj_data)
+            l_new.num_layer = len(mylayers)
             mylayers.append(l_new)
-            q = self.__compute_q(rem_layers)
-            q_vals.append(q)
-        self.q_vals = q_vals
+            H.append(self.layer_entropy(l_new, approx))
+            H_sum += H[-1] - H[l1] - H[l2]
+            n_rem -= 1
+            q_vals.append(1.0 - H_sum / n_rem / H_aggr)
         return q_vals
-        pass
 
-    
-    def __compute_q_approx(self, layers):
-        H_avg = 0
-        if not self.aggr:
-            self.compute_aggregated()
-            self.aggr.compute_VN_entropy_approx(self.poly)
-        for l in layers:
-            if not l.entropy_approx:
-                l.compute_VN_entropy_approx(self.poly)
-            H_avg += l.entropy_approx
-        H_avg /= len(layers)
-        q = 1.0 - H_avg / self.aggr.entropy_approx
-        return q
+    def get_q_profile(self):
+        if self.Z is None:
+            self.reduce()
+        self.q_vals = self.__q_profile(self.Z, False)
+        return self.q_vals
 
     def get_q_profile_approx(self):
-        mylayers = copy.copy(self.layers)
-        rem_layers = copy.copy(self.layers)
-        q_vals = []
-        if self.Z_approx == None:
+        if self.Z_approx is None:
             self.reduce_approx()
-        q = self.__compute_q_approx(rem_layers)
-        q_vals.append(q)
-        n = len(self.layers)
-        for l1, l2, _d, _x in self.Z_approx:
-            l_new = layer(matrix=mylayers[int(l1)].adj_matr)
-            l_new.num_layer = n 
-            n += 1 
-            l_new.aggregate(mylayers[int(l2)])
-            rem_layers.remove(mylayers[int(l1)])
-            rem_layers.remove(mylayers[int(l2)])
-            rem_layers.append(l_new)
-            mylayers.append(l_new)
-            q = self.__compute_q_approx(rem_layers)
-            q_vals.append(q)
-        self.q_vals_approx = q_vals
-        return q_vals
-        
+        self.q_vals_approx = self.__q_profile(self.Z_approx, True)
+        return self.q_vals_approx
+
     def compute_partitions(self):
         if (self.verb):
             sys.stderr.write("Getting partitions...\n")
-        if self.Z == None:
+        if self.Z is None:
             self.reduce()
-        if self.q_vals == None:
+        if self.q_vals is None:
             self.get_q_profile()
         sets = {}
         M = len(self.layers)
@@ -468,9 +654,9 @@ class multiplex_red:
     def compute_partitions_approx(self):
         if (self.verb):
             sys.stderr.write("Getting partitions (approx)...\n")
-        if self.Z_approx == None:
+        if self.Z_approx is None:
             self.reduce_approx()
-        if self.q_vals_approx == None:
+        if self.q_vals_approx is None:
             self.get_q_profile_approx()
         sets = {}
         M = len(self.layers)
@@ -501,7 +687,7 @@ class multiplex_red:
         if not has_matplotlib:
             sys.stderr.write("No matplotlib module found in draw_dendrogram...Exiting!!!\n")
             sys.exit(3)
-        if self.Z == None:
+        if self.Z is None:
             if not force:
                 sys.stderr.write("Please call reduce() first or specify 'force=True'")
             else:
@@ -514,7 +700,7 @@ class multiplex_red:
         if not has_matplotlib:
             sys.stderr.write("No matplotlib module found in draw_dendrogram_approx...Exiting!!!\n")
             sys.exit(3)
-        if self.Z_approx == None:
+        if self.Z_approx is None:
             if not force:
                 sys.stderr.write("Please call reduce_approx() first or specify 'force=True'")
             else:
@@ -10,16 +10,31 @@ Steps:
 """
 import os
 import re
+import multiprocessing as mp
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from MultiTensor_Pkg import AUC as mt_auc
+from MultiTensor_Pkg import tools as mt_tools
+
 
 def prep_uwv_tensors(file_dir, file_end, this_k, num_layers):
     """Read outputted MultiTensor data files holding u and v matrices and
-    w tensor into numpy arrays"""
+    w tensor into numpy arrays. If MultiTensor was run with -b=1, the arrays
+    are memory-mapped from the binary uvw_K*.npz instead of parsing text"""
+    bundle_file = mt_tools.results_file(file_dir, file_end)
+    if os.path.isfile(bundle_file):
+        results = mt_tools.load_results(bundle_file)
+        w_tensor = results['w']
+        if w_tensor.ndim == 2:
+            # Assortative fit only stores the diagonal of each layer, shape K * L
+            w_tensor = np.einsum('ka,kq->kqa', w_tensor, np.eye(int(this_k)))
+        print "Shapes --> U:", np.shape(results['u']), "W:", np.shape(w_tensor), "V:", np.shape(results['v'])
+        return results['u'], w_tensor, results['v'], results['nodes'].tolist()
+
     # Read u matrix file to a dataframe and then convert to np array
     u_df = pd.read_table(os.path.join(file_dir, 'u_K'+file_end),
                          delim_whitespace=True, skiprows=[0],
@@ -64,85 +79,42 @@ def prep_uwv_tensors(file_dir, file_end, this_k, num_layers):
     return u_matrix, w_tensor, v_matrix, node_list
 
 #
-def multiply_uwv(u_matrix, w_tensor, v_matrix, num_layers):
-    """Matrix multiply u, each layer of w and v. Product shape is N x N x L"""
-    u_dot_w_dot_v = np.zeros((np.shape(u_matrix)[0], np.shape(u_matrix)[0], num_layers))
-    for lyr in range(num_layers):
-        u_dot_w = np.mat(u_matrix) * np.mat(w_tensor[:, :, lyr])
-        u_dot_w_dot_v[:, :, lyr] = u_dot_w * np.mat(v_matrix.T)
-
-    return u_dot_w_dot_v
-
-#
-def build_exp_act_tups(u_dot_w_dot_v, actual_ew_df, node_list, num_layers):
-    """Build dict of lists of tuples of (expected_ew, actual_ew) for AUC calculation"""
-    if num_layers == 14:
-        exp_act_ew_dict = {lyr: [] for lyr in range(1, num_layers+1)}
-        plus_i = 0
-    elif num_layers == 2:
-        test_lyr = int(list(actual_ew_df.columns)[-1][1:])
-        exp_act_ew_dict = {test_lyr: []}
-        plus_i = 1
-
-    for row in actual_ew_df.itertuples():
-        try:
-            pol_idx = node_list.index(row[1])
-        except ValueError:
-            pol_idx = 'x'
-
-        try:
-            plt_idx = node_list.index(row[2])
-        except ValueError:
-            plt_idx = 'x'
-
-        for idx, act_edg_wght in enumerate(row[3:]):
-            if pol_idx != 'x' and plt_idx != 'x':
-                expected_ew = u_dot_w_dot_v[pol_idx, plt_idx, idx+plus_i]
-            else:
-                # If either the plant or the pollinator was not in the training set, so
-                #  no estimate is available, use expected edge weight of zero
-                expected_ew = 0.0
-            # Add tuple to correct layer
-            if num_layers == 14:
-                exp_act_ew_dict[idx+1].append((expected_ew, act_edg_wght))
-            elif num_layers == 2:
-                exp_act_ew_dict[test_lyr].append((expected_ew, act_edg_wght))
-
-    return exp_act_ew_dict
+def build_exp_act_arrays(u_matrix, w_tensor, v_matrix, actual_ew_df, node_list, num_layers):
+    """Build dict of (expected_ew, actual_ew) arrays per held-out layer for AUC
+    calculation. Only the u[i] * W_l * v[j] values of the held-out pairs are
+    computed, the N x N x L expected tensor is never formed. The actual edge
+    weight columns of actual_ew_df are the last layers of the fit: all 14 for
+    the all-layer fit, the test layer for the two-layer fit"""
+    node_idx = {name: idx for idx, name in enumerate(node_list)}
+    pol_idx = actual_ew_df.iloc[:, 0].map(node_idx).values
+    plt_idx = actual_ew_df.iloc[:, 1].map(node_idx).values
+    # If either the plant or the pollinator was not in the training set, so
+    #  no estimate is available, use expected edge weight of zero
+    known = ~(pd.isnull(pol_idx) | pd.isnull(plt_idx))
+
+    actual_cols = list(actual_ew_df.columns[2:])
+    first_lyr = num_layers - len(actual_cols)
+    actual_ew = actual_ew_df[actual_cols].values
+    expected_ew = np.zeros(actual_ew.shape)
+    expected_ew[known] = np.einsum('nk,kql,nq->nl',
+                                   u_matrix[pol_idx[known].astype(int)],
+                                   w_tensor[:, :, first_lyr:],
+                                   v_matrix[plt_idx[known].astype(int)])
+
+    return {int(col[1:]): (expected_ew[:, c], actual_ew[:, c])
+            for c, col in enumerate(actual_cols)}
 
 #
 def calculate_directed_auc(exp_act_ew_dict):
-    """Calculate area under the ROC curve. Ideal is for the ordering of expected
-    edge weights to match to ordering of actual edge weights.
-    sorted_m is a list of tuples (expected_ij, actual_ij) order ascending by
-    actuals"""
-    sum_layers_auc = 0.0
-
-    for layer in exp_act_ew_dict.keys():
-        sorted_m = sorted(exp_act_ew_dict[layer], key=lambda tup: tup[0])
-        max_actual_integer = max(exp_act_ew_dict[layer], key=lambda tup: tup[1])[1]
-        observed_actuals = np.zeros(max_actual_integer+1)
-        penalty = 0.
-
-        for _, act in sorted_m:
-            # Increment position of value already encountered
-            observed_actuals[int(round(act))] += 1
-            for q in range(int(round(act))+1, max_actual_integer+1):
-                # Increment the penality by the number of entries with
-                #  A_ij>act already encoutered
-                penalty += observed_actuals[q]
-
-        # Calculate denominator to normalize
-        denom = 0.
-        for k in range(max_actual_integer+1):
-            m = 0.
-            for p in range(k+1, max_actual_integer+1):
-                m += observed_actuals[p]
-            denom += m * observed_actuals[k]
-
-        sum_layers_auc += 1. - (penalty / denom)
-
-    return sum_layers_auc
+    """Calculate area under the ROC curve, summed over layers. Ideal is for the
+    ordering of expected edge weights to match to ordering of actual edge
+    weights. Ties in the expected weights count half. Layers whose actual
+    weights are all equal have no AUC and are skipped"""
+    layers = sorted(exp_act_ew_dict.keys())
+    expected_ew = np.column_stack([exp_act_ew_dict[lyr][0] for lyr in layers])
+    actual_ew = np.column_stack([exp_act_ew_dict[lyr][1] for lyr in layers])
+
+    return np.nansum(mt_auc.weighted_auc(expected_ew, np.round(actual_ew)))
 
 #
 def select_k():
@@ -152,7 +124,7 @@ def select_k():
     Steps:
     - Input AllSites_adjacency.dat to MultiTensor main.py
     - Confirm dimensions of 3 outputted matrices u, v, w
-    - Get product of u * w * v. Output matrix should be size N * N * L
+    - Get product of u * w * v for the held-out pairs in each layer
     - Compare E(edge weight) with actual with AUC calculation
     - Put those steps in a loop for multiple values of k
     - Select k with highest prediction accuracy
@@ -169,8 +141,6 @@ def select_k():
             u_mat, w_tens, v_mat, node_names = prep_uwv_tensors(file_dir=MT_UWV_OUTPUT,
                                                                 file_end=current_k+'.dat',
                                                                 this_k=current_k, num_layers=14)
-            expect_edg_wght = multiply_uwv(u_mat, w_tens, v_mat, num_layers=14)
-
             # Read in actual edge weights from holdout file
             col_names = ["Pollinator", "Plant"] + ["L"+str(l) for l in range(1, 15)]
             actual_edg_wgt_df = pd.read_table(os.path.join(ALL_ADJ_DIR, 'AllSites_holdout.dat'),
@@ -179,8 +149,8 @@ def select_k():
                                               names=col_names,
                                               usecols=[i for i in range(1, 17)])
 
-            exp_act = build_exp_act_tups(expect_edg_wght, actual_edg_wgt_df,
-                                         node_names, num_layers=14)
+            exp_act = build_exp_act_arrays(u_mat, w_tens, v_mat, actual_edg_wgt_df,
+                                           node_names, num_layers=14)
             summed_auc = calculate_directed_auc(exp_act)
             print "Summed AUC:", summed_auc, "\n"
             all_auc[int(current_k)] = summed_auc
@@ -198,48 +168,88 @@ def select_k():
     plot_auc_by_k()
 
 #
-def two_site_community_detection():
+_HOLDOUT_CACHE = {}
+
+def read_two_layer_holdout(holdout_dir, site_pair):
+    """Read the held-out edges of the test site of a site pair. Parsed tables
+    are cached in the calling process, keyed by file name and modification
+    time, so calls for several K parse each holdout only once"""
+    holdout_file = os.path.join(holdout_dir, "Sites_{}_{}_holdout.dat".format(*site_pair))
+    key = (holdout_file, os.path.getmtime(holdout_file))
+    if key not in _HOLDOUT_CACHE:
+        col_names = ["Pollinator", "Plant", "L"+str(site_pair[1])]
+        _HOLDOUT_CACHE[key] = pd.read_table(holdout_file, delim_whitespace=True,
+                                            header=None, index_col=False,
+                                            names=col_names, usecols=[1, 2, 3])
+    return _HOLDOUT_CACHE[key]
+
+_EVALUATION = {}
+
+def _init_evaluation(holdouts):
+    """Keep the holdout tables read by the parent in the worker's globals"""
+    _EVALUATION['holdouts'] = holdouts
+
+def evaluate_site_pair(task):
+    """Summed AUC of the MultiTensor fit of one (train, test) site pair on the
+    test site holdout. task is (site_pair, mt_dir, this_k)"""
+    site_pair, mt_dir, this_k = task
+    mt_output_filename = '{}_{}_{}.dat'.format(this_k, site_pair[0], site_pair[1])
+    u_mat, w_tens, v_mat, node_names = prep_uwv_tensors(file_dir=mt_dir,
+                                                        file_end=mt_output_filename,
+                                                        this_k=this_k, num_layers=2)
+    actual_edg_wgt_df = _EVALUATION['holdouts'][site_pair]
+    exp_act = build_exp_act_arrays(u_mat, w_tens, v_mat, actual_edg_wgt_df,
+                                   node_names, num_layers=2)
+    return site_pair, calculate_directed_auc(exp_act)
+
+def pairwise_auc_matrix(mt_dir, holdout_dir, this_k=3, num_sites=None,
+                        jobs=1, outfile=None):
+    """Evaluate every site pair fitted in mt_dir and return the num_sites x
+    num_sites array of AUC values, row is train site and column is test site.
+    Pairs without a fit are left at 0. The holdouts are read once here, see
+    read_two_layer_holdout, and handed to a pool of jobs processes that
+    evaluate the site pairs. If outfile is given the array is also saved with
+    np.save"""
+    site_pairs = set()
+    for file_name in os.listdir(mt_dir):
+        site_nums = re.findall(r'\d+', file_name)
+        if len(site_nums) == 3 and site_nums[0] == str(this_k):
+            site_pairs.add((int(site_nums[1]), int(site_nums[2])))
+    site_pairs = sorted(site_pairs)
+    if num_sites is None:
+        num_sites = max([max(pair) for pair in site_pairs] + [0])
+
+    holdouts = dict((pair, read_two_layer_holdout(holdout_dir, pair)) for pair in site_pairs)
+    tasks = [(pair, mt_dir, this_k) for pair in site_pairs]
+    if jobs > 1 and len(tasks) > 1:
+        pool = mt_tools.start_pool(jobs, _init_evaluation, (holdouts,))
+        results = mt_tools.pool_map(pool, evaluate_site_pair, tasks,
+                                    chunksize=max(1, len(tasks) // (4 * jobs)))
+    else:
+        _init_evaluation(holdouts)
+        results = [evaluate_site_pair(task) for task in tasks]
+
+    auc_npa = np.zeros((num_sites, num_sites))
+    for site_pair, pair_auc in results:
+        print "Site pair:", site_pair, "Pair AUC:", pair_auc
+        auc_npa[site_pair[0]-1, site_pair[1]-1] = pair_auc
+
+    if outfile is not None:
+        np.save(outfile, auc_npa)
+
+    return auc_npa
+
+#
+def two_site_community_detection(jobs=1):
     """
     python main.py -a="Sites_1_1_adjacency.dat" -f="two_layer_adjacency" -l=2 -k=3 -E="_1_1.dat"
     """
-    processed_site_pairs = []
-    all_auc = {}
-
-    for file_name in os.listdir(MT_TWO_DIR):
-        current_site_pair = (re.findall(r'\d+', file_name)[1], re.findall(r'\d+', file_name)[2])
-        if current_site_pair not in processed_site_pairs:
-            print "Site pair:", current_site_pair
-            processed_site_pairs.append(current_site_pair)
-
-            mt_output_filename = '3_{}_{}.dat'.format(current_site_pair[0], current_site_pair[1])
-            u_mat, w_tens, v_mat, node_names = prep_uwv_tensors(file_dir=MT_TWO_DIR,
-                                                                file_end=mt_output_filename,
-                                                                this_k=3, num_layers=2)
-            expect_edg_wght = multiply_uwv(u_mat, w_tens, v_mat, num_layers=2)
-
-            # Read in actual edge weights from holdout file
-            holdout_file = "Sites_{}_{}_holdout.dat".format(current_site_pair[0],
-                                                            current_site_pair[1])
-            col_names = ["Pollinator", "Plant", "L"+current_site_pair[1]]
-            actual_edg_wgt_df = pd.read_table(os.path.join(TWO_ADJ_HOLDOUT_DIR, holdout_file),
-                                              delim_whitespace=True,
-                                              header=None, index_col=False,
-                                              names=col_names, usecols=[1, 2, 3])
-
-            exp_act = build_exp_act_tups(expect_edg_wght, actual_edg_wgt_df,
-                                         node_names, num_layers=2)
-            pair_auc = calculate_directed_auc(exp_act)
-            print "Pair AUC:", pair_auc, "\n"
-            all_auc[(int(current_site_pair[0]), int(current_site_pair[1]))] = pair_auc
+    hm_npa = pairwise_auc_matrix(MT_TWO_DIR, TWO_ADJ_HOLDOUT_DIR, this_k=3,
+                                 num_sites=14, jobs=jobs,
+                                 outfile=os.path.join("data", "pairwise_auc.npy"))
 
     def plot_pairwise_auc():
         """Plot the pairwise directed AUC for every site pair"""
-        hm_npa = np.zeros((14, 14))
-        for site_pair, calc_auc in all_auc.items():
-            train_site = int(site_pair[0]) - 1
-            test_site = int(site_pair[1]) - 1
-            hm_npa[train_site, test_site] = calc_auc
-        
         xy_labels = [0] * 14
         for file_name in os.listdir(os.path.join("data", "sites")):
             site_num = int(re.findall(r'\d+', file_name)[0])
@@ -259,20 +269,14 @@ def two_site_community_detection():
 
     def plot_auc_histogram():
         """Plot histogram of all AUC values to get center for heatmap"""
-        ax = sns.distplot(all_auc.values())
+        ax = sns.distplot(hm_npa[hm_npa != 0])
         plt.title("AUC Histogram")
         sns.plt.show()
 
     def plot_multiple_measures():
         """Barplot comparing 1-Jenson-Shannon and Community structure
         edge prediction"""
-        cd_npa = np.zeros((14, 14))
-        for site_pair, calc_auc in all_auc.items():
-            train_site = int(site_pair[0]) - 1
-            test_site = int(site_pair[1]) - 1
-            cd_npa[train_site, test_site] = calc_auc
-        
-        cd_avg = np.mean(cd_npa, axis=0)
+        cd_avg = np.mean(hm_npa, axis=0)
 
         meas_df = pd.read_csv(os.path.join("data", "multple_measures.csv"),
                               header=0, index_col=0)
@@ -303,4 +307,4 @@ if __name__ == "__main__":
     MT_TWO_DIR = os.path.join("data", "multitensor_output_2_layer")
     TWO_ADJ_HOLDOUT_DIR = os.path.join("data", "two_layer_holdout")
     # select_k()
-    two_site_community_detection()
+    two_site_community_detection(jobs=mp.cpu_count())
@@ -2,6 +2,7 @@
 Create the multilayer network object with pymnet library
 """
 import os
+import numpy as np
 import pandas as pd
 
 import pymnet
@@ -27,55 +28,58 @@ def build_site_network_layers(dir_loc):
 
         MNET.add_layer(site_num)
 
-        # Iterate through every plant/pollinator interaction and add the edge weights
-        #   between those nodes. Note: The node is created implicitly if it does not exist.
-        for row_name in df.index:
-            # Pollinators are rows and plants are columns
-            # Access the summary name from the correct lookup table
-            try:
-                pollinator = POLLINATOR_LOOKUP[row_name]
-            except KeyError:
-                print("Pollinator not found: ", row_name)
-                pollinator = row_name
-
-            for col_name in df.columns:
-                try:
-                    plant = PLANT_LOOKUP[col_name]
-                except KeyError:
-                    print("Plant not found: ", col_name)
-                    plant = col_name
-
-                MNET[pollinator, plant, site_num, site_num] = df.loc[row_name, col_name]
-                node_color[(plant, site_num)] = "forestgreen"
-                node_color[(pollinator, site_num)] = "gold"
+        # Pollinators are rows and plants are columns
+        # Access the summary names from the correct lookup table, once per label
+        pollinators = utils.pretty_names(df.index, POLLINATOR_LOOKUP, "Pollinator")
+        plants = utils.pretty_names(df.columns, PLANT_LOOKUP, "Plant")
+
+        # Add the edge weights of the plant/pollinator pairs that interact, zero
+        #   weights are not edges. Note: The node is created implicitly if it does not exist.
+        counts = df.values
+        rows, cols = np.nonzero(counts)
+        for pollinator, plant, weight in zip(pollinators[rows], plants[cols], counts[rows, cols].tolist()):
+            MNET[pollinator, plant, site_num, site_num] = weight
+
+        node_color.update(((plant, site_num), "forestgreen") for plant in set(plants))
+        node_color.update(((pollinator, site_num), "gold") for pollinator in set(pollinators))
 
     return site_lookup_tbl, node_color
 
+#
+def active_layer_nodes():
+    """Index of the nodes that have edges within each layer, built once from
+    the intra-layer edges. Returns dict layer -> set of nodes"""
+    layer_nodes = {}
+    for node1, node2, layer1, layer2, weight in MNET.edges:
+        if layer1 == layer2:
+            layer_nodes.setdefault(layer1, set()).update((node1, node2))
+    return layer_nodes
+
 #
 def add_inter_layer_edges():
-    """Add the edges between layers"""
+    """Add the edges between layers. A node is coupled between two layers if it
+    has edges within both. Rows of the distance table with a site that is not a
+    layer of the network are reported and skipped"""
     df = pd.read_csv(DIST_DIR_FILE, header=0)
-    for row in df.itertuples():
-        from_site_name = row[1].split('_')[0] + row[1].split('_')[1]
-        to_site_name = row[2].split('_')[0] + row[2].split('_')[1]
-
-        # Access site number from site lookup table
-        try:
-            from_site_num = SITE_LOOKUP[from_site_name]
-        except KeyError:
-            print("From site not found: ", from_site_name)
-            break
-
-        try:
-            to_site_num = SITE_LOOKUP[to_site_name]
-        except KeyError:
-            print("To site not found: ", to_site_name)
-            break
-
-        # Add between layer edge if the node has edges within both layers
-        for node in list(MNET):
-            if MNET[node, from_site_num].deg() > 0 and MNET[node, to_site_num].deg() > 0:
-                MNET[node, node, from_site_num, to_site_num] = row[3]
+    # Site names like WesternSahara_1 are WesternSahara1 in the site file names
+    from_site_names = df.iloc[:, 0].str.replace('_', '')
+    to_site_names = df.iloc[:, 1].str.replace('_', '')
+
+    # Access site numbers from site lookup table
+    from_site_nums = from_site_names.map(SITE_LOOKUP)
+    to_site_nums = to_site_names.map(SITE_LOOKUP)
+    unknown = from_site_nums.isnull() | to_site_nums.isnull()
+    if unknown.any():
+        missing = set(from_site_names[from_site_nums.isnull()]) | set(to_site_names[to_site_nums.isnull()])
+        print("Sites not found, skipped {} distances: {}".format(unknown.sum(), sorted(missing)))
+
+    layer_nodes = active_layer_nodes()
+    for from_site_num, to_site_num, distance in zip(from_site_nums[~unknown],
+                                                    to_site_nums[~unknown],
+                                                    df.iloc[:, 2][~unknown].tolist()):
+        shared_nodes = layer_nodes.get(from_site_num, set()) & layer_nodes.get(to_site_num, set())
+        for node in shared_nodes:
+            MNET[node, node, from_site_num, to_site_num] = distance
 
 #
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""Fit and score every ordered pair of sites in one process. Each two-layer
+tensor is built in memory from the one-layer adjacency files, fitted with
+MultiTensor and scored on the held-out edges of the test site, so no two-layer
+adjacency, holdout or u/v/w files are written. Results are appended to a
+single table as pairs finish, an interrupted run resumes where it stopped."""
+import os
+import re
+import itertools
+import multiprocessing as mp
+
+import pandas as pd
+import numpy as np
+
+from MultiTensor_Pkg import sweep as mt_sweep
+from MultiTensor_Pkg import tools as mt_tools
+
+
+RESULT_COLS = ["train_site", "test_site", "K", "likelihood", "auc", "seconds"]
+
+
+def read_one_layer_sites(one_adj_dir):
+    """Read the one-layer adjacency file of every site once. Returns dict
+    site number -> DataFrame with columns Edge, Pollinator, Plant and the
+    edge weights of that site"""
+    col_names = ["Edge", "Pollinator", "Plant"]
+    sites = {}
+    for file_name in os.listdir(one_adj_dir):
+        site_num = int(re.findall(r'\d+', file_name)[0])
+        sites[site_num] = pd.read_csv(os.path.join(one_adj_dir, file_name),
+                                      delim_whitespace=True,
+                                      header=None, index_col=False,
+                                      names=col_names+['L'+str(site_num)],
+                                      usecols=[0, 1, 2, 2+site_num],
+                                      dtype={"Pollinator": str, "Plant": str})
+    return sites
+
+#
+def two_layer_edges(train_site, test_site, seed):
+    """Split as in utils.create_two_layer_adjacency, in memory. 20% of the test
+    site edges are held out and the rest is merged with the train site.
+    Returns the edges and the holdout as (sources, targets, weights)"""
+    test_holdout = test_site.sample(frac=0.2, random_state=seed)
+    test_site = test_site.drop(test_holdout.index)
+
+    two_adj_mat = pd.merge(train_site, test_site, how='inner',
+                           on=["Edge", "Pollinator", "Plant"])
+    two_adj_mat.fillna(value=0, inplace=True)
+
+    edges = (list(two_adj_mat["Pollinator"]), list(two_adj_mat["Plant"]),
+             two_adj_mat.iloc[:, 3:].values.astype(np.int64))
+    holdout = (list(test_holdout["Pollinator"]), list(test_holdout["Plant"]),
+               test_holdout.iloc[:, 3:].values.astype(np.int64))
+    return edges, holdout
+
+#
+_PIPELINE = {}
+
+def _init_pipeline(sites, params):
+    """Keep the site tables inherited from the parent in the worker's globals"""
+    _PIPELINE['sites'] = sites
+    _PIPELINE['params'] = params
+
+def fit_site_pair(site_pair):
+    """Fit the two-layer tensor of a (train, test) site pair and score it on
+    the test site holdout. Returns one row of the results table"""
+    params = dict(_PIPELINE['params'])
+    this_k = params.pop('K')
+    # Same holdout for a pair on every run, so resumed runs are comparable
+    seed = hash((params.pop('split_seed'),) + tuple(site_pair)) % 2**32
+    edges, holdout = two_layer_edges(_PIPELINE['sites'][site_pair[0]],
+                                     _PIPELINE['sites'][site_pair[1]], seed)
+    max_l, pair_auc, seconds = mt_sweep.fit_edges(edges, holdout, this_k, **params)
+    return site_pair[0], site_pair[1], this_k, max_l, pair_auc, seconds
+
+#
+def drop_partial_row(results_file):
+    """Cut the last row of the results table if an interruption left it
+    without its newline, its last field may be a number cut short. Rows are
+    written whole with their newline, so every other row is complete"""
+    with open(results_file, 'rb+') as infile:
+        content = infile.read()
+        if content and not content.endswith('\n'):
+            infile.truncate(content.rfind('\n') + 1)
+
+#
+def run_pairwise_pipeline(one_adj_dir, results_file, K=3, jobs=1, split_seed=0, **params):
+    """Fit and score all ordered site pairs, parallel over jobs processes.
+    Each finished pair is appended to the csv results_file, which is also the
+    checkpoint: pairs already in it for this K are skipped. params are passed
+    to MultiTensor (N_real, maxit, sparse, ...). Returns the results table"""
+    sites = read_one_layer_sites(one_adj_dir)
+
+    done = set()
+    if os.path.isfile(results_file):
+        drop_partial_row(results_file)
+    if os.path.isfile(results_file) and os.path.getsize(results_file) > 0:
+        done_df = pd.read_csv(results_file)
+        done_df = done_df[done_df["K"] == K]
+        done = set(zip(done_df["train_site"], done_df["test_site"]))
+    else:
+        with open(results_file, 'w') as outfile:
+            outfile.write(",".join(RESULT_COLS)+'\n')
+
+    todo = [pair for pair in itertools.permutations(sorted(sites), 2) if pair not in done]
+    print "Site pairs to fit:", len(todo), "of", len(sites)*(len(sites)-1)
+
+    params['K'] = K
+    params['split_seed'] = split_seed
+    params['jobs'] = 1  # workers can not start pools of their own
+    _init_pipeline(sites, params)
+    pool = None
+    if jobs > 1 and len(todo) > 1:
+        # Workers ignore Ctrl-C, the parent terminates them, see tools.pool_map
+        pool = mt_tools.start_pool(jobs, _init_pipeline, (sites, params))
+        pending = pool.imap_unordered(fit_site_pair, todo)
+        # A timeout keeps the wait interruptible by Ctrl-C in Python 2
+        results = (pending.next(1e9) for _pair in todo)
+    else:
+        results = itertools.imap(fit_site_pair, todo)
+
+    try:
+        with open(results_file, 'a') as outfile:
+            for row in results:
+                print "Site pair:", row[:2], "Pair AUC:", row[4]
+                outfile.write(",".join(repr(x) for x in row)+'\n')
+                outfile.flush()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return pd.read_csv(results_file)
+
+#
+if __name__ == "__main__":
+    ONE_ADJ_DIR_LOC = os.path.join("data", "one_layer_adjacency")
+    RESULTS_FILE_LOC = os.path.join("data", "pairwise_results.csv")
+    run_pairwise_pipeline(ONE_ADJ_DIR_LOC, RESULTS_FILE_LOC, K=3,
+                          jobs=mp.cpu_count(),
+                          N_real=1, maxit=500, tolerance=0.1, decision=2,
+                          err_max=0.0000001, sparse=True)
@@ -1,55 +1,66 @@
 """Check which plants and pollinators have interactions at each site"""
 import os
+import re
+import collections
 
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 import utils
 
 
+_PRESENCE = {}
+
+def site_presence(site_dir):
+    """Presence of every pollinator and plant at each site, from one pass over
+    the labels of the site files (see utils.read_site_labels). Returns
+    (sites, pollinators, plants): the site names ordered by site number and,
+    for each kind, a boolean species x sites DataFrame indexed by the full
+    species names. Kept per process while no file in site_dir has changed"""
+    file_mtimes = dict((file_name, os.path.getmtime(os.path.join(site_dir, file_name)))
+                       for file_name in os.listdir(site_dir))
+    cached = _PRESENCE.get(site_dir)
+    if cached is not None and cached[0] == file_mtimes:
+        return cached[1]
+
+    site_files = sorted(file_mtimes, key=lambda f: int(re.findall(r'\d+', f)[0]))
+    sites = [file_name.split('_')[0] for file_name in site_files]
+    # Species name -> indexes of the sites it is present in
+    pollinator_sites = collections.defaultdict(set)
+    plant_sites = collections.defaultdict(set)
+    for site_idx, file_name in enumerate(site_files):
+        pollinators, plants = utils.read_site_labels(os.path.join(site_dir, file_name))
+        # Pollinators are rows and plants are columns
+        for poll in pollinators:
+            pollinator_sites[poll].add(site_idx)
+        for plnt in plants:
+            plant_sites[plnt].add(site_idx)
+
+    presence = (sites, presence_matrix(pollinator_sites, sites),
+                presence_matrix(plant_sites, sites))
+    _PRESENCE[site_dir] = (file_mtimes, presence)
+    return presence
+
+#
+def presence_matrix(species_sites, sites):
+    """Boolean species x sites DataFrame, species sorted, from a dict
+    species -> set of site indexes"""
+    species = sorted(species_sites)
+    rows = np.repeat(np.arange(len(species)), [len(species_sites[sp]) for sp in species])
+    cols = [site_idx for sp in species for site_idx in species_sites[sp]]
+    presence = np.zeros((len(species), len(sites)), dtype=bool)
+    presence[rows, cols] = True
+    return pd.DataFrame(presence, index=species, columns=sites)
+
+#
 def pp_histogram():
     """Histograms of number of sites each plant and pollinator is present in"""
-    # Pollinators are rows and plants are columns
-    pollinators = {}
-    plants = {}
-    sites = []
-
-    for file_name in os.listdir("data"):
-        site = file_name.split('.')[0]
-        sites.append(site)
-        df = pd.read_csv("data/" + file_name, header=0, index_col=0)
-        for col_name in df.columns:
-            if col_name in plants:
-                plants[col_name].append(site)
-            else:
-                plants[col_name] = [site]
-
-        for row_name in df.index:
-            if row_name in pollinators:
-                pollinators[row_name].append(site)
-            else:
-                pollinators[row_name] = [site]
-
-    cols = list(set(plants.keys()))
-    cols.sort()
-    rows = list(set(pollinators.keys()))
-    rows.sort()
-    sites.sort()
-
-    plant_df = pd.DataFrame(index=sites, columns=cols)
-    poll_df = pd.DataFrame(index=sites, columns=rows)
-
-    for k, v in plants.iteritems():
-        for site in v:
-            plant_df.loc[site, k] = 1
-
-    for k, v in pollinators.iteritems():
-        for site in v:
-            poll_df.loc[site, k] = 1
-
-    plant_sum = plant_df.sum(axis=0)
-    pollntr_sum = poll_df.sum(axis=0)
+    _, poll_df, plant_df = site_presence(SITE_DIR)
+
+    plant_sum = plant_df.sum(axis=1)
+    pollntr_sum = poll_df.sum(axis=1)
 
     fig = plt.figure()
     ax = plant_sum.plot.hist()
@@ -67,55 +78,16 @@ def pp_histogram():
 
 #
 def check_superset():
-    species_list = []
-
-    for site_file in os.listdir(SITE_DIR):
-        site_df = pd.read_csv(os.path.join(SITE_DIR, site_file), index_col=0, header=0)
-
-        for idx_name in site_df.index:
-            try:
-                species = POLLINATOR_LOOKUP[idx_name]
-            except KeyError:
-                print("Pollinator not found: ", idx_name)
-                species = idx_name
-            if species not in species_list:
-                species_list.append(species)
-
-        for col_name in site_df.columns:
-            try:
-                species = PLANT_LOOKUP[col_name]
-            except KeyError:
-                print("Plant not found: ", col_name)
-                species = col_name
-            if species not in species_list:
-                species_list.append(species)
-
-    all_species_df_cols = ["Site"+str(l) for l in range(1, 15)]
-    species_list.sort()
-    all_species_df = pd.DataFrame({sn:[0]*len(species_list) for sn in all_species_df_cols},
-                                  index=species_list)
-
-    for site_file in os.listdir(SITE_DIR):
-        site_df = pd.read_csv(os.path.join(SITE_DIR, site_file), index_col=0, header=0)
-        site_num = site_file.split('_')[0]
-        for idx_name in site_df.index:
-            try:
-                species = POLLINATOR_LOOKUP[idx_name]
-            except KeyError:
-                print("Pollinator not found: ", idx_name)
-                species = idx_name
-            all_species_df.loc[species, site_num] = 1
-
-        for col_name in site_df.columns:
-            try:
-                species = PLANT_LOOKUP[col_name]
-            except KeyError:
-                print("Plant not found: ", col_name)
-                species = col_name
-            all_species_df.loc[species, site_num] = 1
-
-    all_species_df = all_species_df[["Site1", "Site2", "Site3", "Site4", "Site5", "Site6", "Site7",
-                                     "Site8", "Site9", "Site10", "Site11", "Site12", "Site13", "Site14"]]
+    _, poll_df, plant_df = site_presence(SITE_DIR)
+
+    # Rows of raw names with the same summary name are merged
+    all_species_df = pd.concat([
+        pd.DataFrame(poll_df.values, columns=poll_df.columns,
+                     index=utils.pretty_names(poll_df.index, POLLINATOR_LOOKUP, "Pollinator")),
+        pd.DataFrame(plant_df.values, columns=plant_df.columns,
+                     index=utils.pretty_names(plant_df.index, PLANT_LOOKUP, "Plant"))])
+    all_species_df = all_species_df.groupby(level=0).any().astype(int)
+
     all_species_df.to_csv("all.csv")
     ax = sns.heatmap(all_species_df, cmap="Blues",
                      yticklabels=False, cbar=False,
@@ -123,7 +95,6 @@ def check_superset():
 
     plt.title("Species Presence by Site")
     sns.plt.show()
-            
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""Round trip of the MultiTensor binary output: the .npz written with -b=1
+is found and read back by cmnty_detect.prep_uwv_tensors"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "MultiTensor_Pkg"))
+
+import MultiTensor as mt
+import tools as tl
+import cmnty_detect
+
+
+class ResultsRoundTrip(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def fit_binary(self, K, end_file, assortative=False):
+        """Fit AllSites for a few iterations and write the results as -b=1 does"""
+        A, B, nodes, _index = tl.read_adjacency(os.path.join(ROOT, "data", "all_layer_adjacency"),
+                                                "AllSites_adjacency.dat", 14)
+        k_out, k_in = tl.node_degrees(A)
+        MT = mt.MultiTensor(N=len(nodes), L=14, K=K, maxit=20, folder=self.out_dir,
+                            end_file=end_file, assortative=assortative,
+                            sparse=True, binary=True)
+        MT.cycle_over_realizations(nodes, B, tl.remove_zero_entries_u(A, k_out),
+                                   tl.remove_zero_entries_v(A, k_in))
+        return MT, nodes
+
+    def check_round_trip(self, K, end_file, assortative=False):
+        MT, nodes = self.fit_binary(K, end_file, assortative)
+        self.assertTrue(os.path.isfile(tl.results_file(self.out_dir, str(K)+end_file)))
+        u_mat, w_tens, v_mat, node_names = cmnty_detect.prep_uwv_tensors(
+            file_dir=self.out_dir, file_end=str(K)+end_file, this_k=K, num_layers=14)
+        np.testing.assert_array_equal(u_mat, MT.u_f)
+        np.testing.assert_array_equal(v_mat, MT.v_f)
+        self.assertEqual(node_names, list(nodes))
+        if assortative:
+            w_expected = np.einsum('ka,kq->kqa', MT.w_f, np.eye(K))
+        else:
+            w_expected = MT.w_f
+        np.testing.assert_array_equal(w_tens, w_expected)
+
+    def test_default_end_file(self):
+        self.check_round_trip(3, ".dat")
+        self.assertTrue(os.path.isfile(os.path.join(self.out_dir, "uvw_K3.npz")))
+
+    def test_site_pair_end_file(self):
+        self.check_round_trip(2, "_1_2.dat")
+        self.assertTrue(os.path.isfile(os.path.join(self.out_dir, "uvw_K2_1_2.npz")))
+
+    def test_assortative(self):
+        self.check_round_trip(2, ".dat", assortative=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
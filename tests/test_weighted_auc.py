@@ -0,0 +1,56 @@
+"""Checks of MultiTensor_Pkg.AUC.weighted_auc against a direct count over all
+pairs of entries"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "MultiTensor_Pkg"))
+
+import AUC
+
+
+def pair_count_auc(expected, actual):
+    """AUC over every pair of entries with different weights, ties count 1/2"""
+    good = pairs = 0.
+    for i in range(len(actual)):
+        for j in range(len(actual)):
+            if actual[i] > actual[j]:
+                pairs += 1
+                if expected[i] > expected[j]:
+                    good += 1
+                elif expected[i] == expected[j]:
+                    good += 0.5
+    return good / pairs if pairs else np.nan
+
+
+class WeightedAUC(unittest.TestCase):
+
+    def test_matches_pair_count(self):
+        rng = np.random.RandomState(0)
+        for n, num_classes in [(60, 2), (80, 5), (200, 12)]:
+            actual = rng.randint(0, num_classes, size=(n, 3))
+            # Few distinct scores, so many ties
+            expected = np.round(rng.rand(n, 3) * 6)
+            auc = AUC.weighted_auc(expected, actual)
+            for l in range(3):
+                self.assertAlmostEqual(auc[l], pair_count_auc(expected[:, l], actual[:, l]))
+
+    def test_floating_point_noise_is_a_tie(self):
+        # Scores that differ only by summation order are tied
+        actual = np.array([0, 1, 0, 2, 1])
+        expected = np.array([0.3, 0.1 + 0.2, 0.2, 0.7, 0.5])
+        self.assertNotEqual(expected[0], expected[1])
+        tied = np.array([0.3, 0.3, 0.2, 0.7, 0.5])
+        self.assertEqual(AUC.weighted_auc(expected, actual), pair_count_auc(tied, actual))
+        noisy = expected * (1 + 1e-14 * np.array([1, -1, 1, -1, 1]))
+        self.assertEqual(AUC.weighted_auc(noisy, actual), AUC.weighted_auc(tied, actual))
+
+    def test_equal_weights_give_nan(self):
+        self.assertTrue(np.isnan(AUC.weighted_auc(np.arange(4.), np.ones(4))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,293 +1,313 @@
 """Utility file of helper functions to process data or create lookup tables"""
 import os
 import re
+import csv
 import string
+import pickle
+import hashlib
+import inspect
 import itertools
 
 import pandas as pd
 import numpy as np
 
 
-def create_node_names(dir_loc):
+_SPECIES_NAMES = {}
+
+def species_name(raw_name):
+    """Summary form of a full plant/pollinator name. If species provided,
+    shorten to genus first initial & whole species. If not provided, shorten
+    to whole genus. If gender or count provided, add to end. Each raw name is
+    only worked out once per process"""
+    try:
+        return _SPECIES_NAMES[raw_name]
+    except KeyError:
+        pass
+
+    # Remove punctuation and create list of strings
+    temp = raw_name.translate(None, string.punctuation).split(' ')
+
+    if "Waiting" in temp[-1]:
+        name = temp[0]
+    elif temp[1]=="cf":
+        name = temp[0] + '_' + temp[-1]
+    elif temp[1]=="sp" and temp[-1].isdigit():
+        name = temp[0] + '_' + temp[-1]
+    elif temp[1]=="sp" and temp[-2].isdigit():
+        name = temp[0] + '_' + temp[-2]
+    elif temp[1] not in ['sp', 'cf'] and temp[-1] not in ['f', 'm']:
+        name = temp[0][0:3] + '_' + temp[1]
+    elif temp[1] not in ['sp', 'cf'] and temp[-1] in ['f', 'm']:
+        name = temp[0][0:3] + '_' + temp[1] + '_' + temp[-1]
+    else:
+        name = temp[0]
+    # Drop non ascii characters
+    name = ''.join([i if ord(i) < 128 else ' ' for i in name])
+
+    _SPECIES_NAMES[raw_name] = name
+    return name
+
+#
+def read_site_labels(file_loc):
+    """Row (pollinator) and column (plant) labels of a site file, read from the
+    header row and the first column only. The header has no cell for the
+    index column, as pandas writes it"""
+    pollinators = []
+    num_fields = None
+    with open(file_loc, 'r') as infile:
+        reader = csv.reader(infile)
+        plants = next(reader)
+        # Rows are streamed, only their first field is kept
+        for row in reader:
+            if row:
+                if num_fields is None:
+                    num_fields = len(row)
+                pollinators.append(row[0])
+
+    if num_fields == len(plants):
+        plants = plants[1:]
+    return pollinators, plants
+
+#
+def create_node_names(dir_loc, use_cache=True):
     """Create lookup table where keys are full plant/pollinator names from the
-    files and values are the summary form. If species provided, shorten to genus
-    first initial & whole species. If not provided, shorten to whole genus. If
-    gender or count provided, add to end."""
+    files and values are the summary form, see species_name. The tables are
+    saved next to dir_loc and reused while no file in dir_loc has changed and
+    the naming rules (the source of species_name and read_site_labels) are
+    the ones the cache was built with"""
+    file_mtimes = dict((file_name, os.path.getmtime(os.path.join(dir_loc, file_name)))
+                       for file_name in os.listdir(dir_loc))
+    cache_file = os.path.join(os.path.dirname(os.path.normpath(dir_loc)),
+                              '.' + os.path.basename(os.path.normpath(dir_loc)) + '_node_names.pkl')
+    rules = hashlib.md5(inspect.getsource(species_name) +
+                        inspect.getsource(read_site_labels)).hexdigest()
+    if use_cache and os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as infile:
+            cached = pickle.load(infile)
+        if cached['file_mtimes'] == file_mtimes and cached.get('rules') == rules:
+            return cached['pollinator_key'], cached['plant_key']
+
     pollinator_key = {}
     plant_key = {}
-
-    for file_name in os.listdir(dir_loc):
-        df = pd.read_csv(os.path.join(dir_loc, file_name), header=0, index_col=0)
-
+    for file_name in sorted(file_mtimes):
+        pollinators, plants = read_site_labels(os.path.join(dir_loc, file_name))
         # Pollinators are rows and plants are columns
-        for poll in df.index:
-            if poll not in pollinator_key:
-                # Remove punctuation and create list of strings
-                temp = poll.translate(None, string.punctuation).split(' ')
-                
-                if "Waiting" in temp[-1]:
-                    name = temp[0]
-                elif temp[1]=="cf":
-                    name = temp[0] + '_' + temp[-1]
-                elif temp[1]=="sp" and temp[-1].isdigit():
-                    name = temp[0] + '_' + temp[-1]
-                elif temp[1]=="sp" and temp[-2].isdigit():
-                    name = temp[0] + '_' + temp[-2]
-                elif temp[1] not in ['sp', 'cf'] and temp[-1] not in ['f', 'm']:
-                    name = temp[0][0:3] + '_' + temp[1]
-                elif temp[1] not in ['sp', 'cf'] and temp[-1] in ['f', 'm']:
-                    name = temp[0][0:3] + '_' + temp[1] + '_' + temp[-1]
-                else:
-                    name = temp[0]
-                # Drop non ascii characters
-                name = ''.join([i if ord(i) < 128 else ' ' for i in name])
-                pollinator_key[poll] = name
-
-        for plnt in df.columns:
-            if plnt not in plant_key:
-                temp = plnt.translate(None, string.punctuation).split(' ')
-                if "Waiting" in temp[-1]:
-                    name = temp[0]
-                elif temp[1]=="cf":
-                    name = temp[0] + '_' + temp[-1]
-                elif temp[1]=="sp" and temp[-1].isdigit():
-                    name = temp[0] + '_' + temp[-1]
-                elif temp[1]=="sp" and temp[-2].isdigit():
-                    name = temp[0] + '_' + temp[-2]
-                elif temp[1] not in ['sp', 'cf'] and temp[-1] not in ['f', 'm']:
-                    name = temp[0][0:3] + '_' + temp[1]
-                elif temp[1] not in ['sp', 'cf'] and temp[-1] in ['f', 'm']:
-                    name = temp[0][0:3] + '_' + temp[1] + '_' + temp[-1]
-                else:
-                    name = temp[0]
-
-                name = ''.join([i if ord(i) < 128 else ' ' for i in name])
-                plant_key[plnt] = name
+        for poll in pollinators:
+            pollinator_key[poll] = species_name(poll)
+        for plnt in plants:
+            plant_key[plnt] = species_name(plnt)
+
+    if use_cache:
+        with open(cache_file, 'wb') as outfile:
+            pickle.dump({'file_mtimes': file_mtimes, 'rules': rules,
+                         'pollinator_key': pollinator_key, 'plant_key': plant_key},
+                        outfile, protocol=2)
 
     return pollinator_key, plant_key
 
 #
-def row_col_matching(a_df, b_df):
-    """Algorithm to add plant/pollinator counts to base df if pair exists.
-    If pair does not exist, add it."""
-    for row_name in a_df.index:
-        for col_name in a_df.columns:
-            try:
-                # Add count if that plant/pollinator pair already exists
-                b_df.loc[row_name, col_name] += a_df.loc[row_name, col_name]
-            except KeyError:
-                # If column does not exist, add it
-                if col_name not in b_df.columns:
-                    b_df[col_name] = 0
-                # If row does not exist, add it
-                if row_name not in b_df.index:
-                    temp_array = np.array([0]*len(b_df.columns))
-                    row_data = np.reshape(temp_array, (1, len(b_df.columns)))
-                    ndf = pd.DataFrame(data=row_data, columns=b_df.columns, index=[row_name])
-                    b_df = pd.concat([b_df, ndf])
-                try:
-                    b_df.loc[row_name, col_name] += a_df.loc[row_name, col_name]
-                except KeyError:
-                    print('WTF! Row: {}  Col: {}'.format(row_name, col_name))
-
-    return b_df
+def collapse_sites(site_dfs):
+    """Add the plant/pollinator counts of any number of site matrices in one
+    pass. Row and column labels are the union of the sites' labels in order of
+    first appearance, a pair missing from a site counts 0"""
+    rows = pd.Index(pd.unique(np.concatenate([df.index.values for df in site_dfs])))
+    cols = pd.Index(pd.unique(np.concatenate([df.columns.values for df in site_dfs])))
+    counts = np.zeros((len(rows), len(cols)),
+                      dtype=np.result_type(*[df.values.dtype for df in site_dfs]))
+
+    for df in site_dfs:
+        # Sums rows listed twice in a site file
+        np.add.at(counts, (rows.get_indexer(df.index)[:, np.newaxis],
+                           cols.get_indexer(df.columns)[np.newaxis, :]), df.values)
+
+    return pd.DataFrame(counts, index=rows, columns=cols)
+
+#
+def collapse_groups(grouping, out_dir):
+    """Collapse groups of sites to one file each. grouping maps an output name
+    to the list of site files in the group, e.g. island -> its two sites. Each
+    site file is read once even if it is in several groups"""
+    site_dfs = {}
+    for group_name, site_files in grouping.items():
+        for file_name in site_files:
+            if file_name not in site_dfs:
+                site_dfs[file_name] = pd.read_csv(os.path.join(SITE_DIR_LOC, file_name),
+                                                  header=0, index_col=0).fillna(0)
+        print("Group: ", group_name, site_files)
+        group_df = collapse_sites([site_dfs[file_name] for file_name in site_files])
+        group_df.to_csv(os.path.join(out_dir, group_name+'.csv'))
 
 #
 def collapse_to_islands():
     """Each island has two site files. Collapse both sites on each island to a single file"""
-    collapsed_islands = []
-    site_list = os.listdir(SITE_DIR_LOC)
-
-    for file_name in site_list:
-        base_df = pd.read_csv(os.path.join(SITE_DIR_LOC, file_name), header=0, index_col=0)
+    grouping = {}
+    for file_name in sorted(os.listdir(SITE_DIR_LOC)):
         site_name = file_name.split('_')[1].split('.')[0][:-1]
+        grouping.setdefault(site_name, []).append(file_name)
 
-        if site_name not in collapsed_islands:
-            collapsed_islands.append(site_name)
-            print("File name: ", file_name)
-            for site_file in site_list:
-                # Find other site on island and confirm it isn't the same site
-                if site_name in site_file and site_file != file_name:
-                    add_df = pd.read_csv(os.path.join(SITE_DIR_LOC, site_file),
-                                         header=0, index_col=0)
-                    print("Match: ", site_file, '/n')
-                    base_df = row_col_matching(add_df, base_df)
-                    base_df.to_csv('data/islands/'+site_name+'.csv')
-                    break
+    collapse_groups(grouping, os.path.join('data', 'islands'))
 
 #
 def collaps_to_main_islands():
     """Collaspe all islands to a single file and collapse the two western sahara
     mainland sites to a single file"""
+    mainlands = ["Site1_WesternSahara1.csv", "Site2_WesternSahara2.csv"]
+    islands = [file_name for file_name in sorted(os.listdir(SITE_DIR_LOC))
+               if file_name not in mainlands]
 
-    main1_df = pd.read_csv(os.path.join(SITE_DIR_LOC, "Site1_WesternSahara1.csv"),
-                           header=0, index_col=0)
-    main2_df = pd.read_csv(os.path.join(SITE_DIR_LOC, "Site2_WesternSahara2.csv"),
-                           header=0, index_col=0)
-    main_df = row_col_matching(main1_df, main2_df)
-    main_df.to_csv('data/mainland_islands/Mainlands.csv')
-
-    base_df = pd.read_csv(os.path.join(SITE_DIR_LOC, "Site3_Fuerteventura1.csv"),
-                          header=0, index_col=0)
-
-    collapsed_islands = ["Site1_WesternSahara1.csv", "Site2_WesternSahara2.csv",
-                         "Site3_Fuerteventura1.csv"]
-    for file_name in os.listdir(SITE_DIR_LOC):
-        if file_name not in collapsed_islands:
-            collapsed_islands.append(file_name)
-            add_df = pd.read_csv(os.path.join(SITE_DIR_LOC, file_name),
-                                 header=0, index_col=0)
-            base_df = row_col_matching(add_df, base_df)
-
-    base_df.to_csv('data/mainland_islands/Islands.csv')
+    collapse_groups({"Mainlands": mainlands, "Islands": islands},
+                    os.path.join('data', 'mainland_islands'))
 
 #
 def collapse_to_single_layer():
     """Collapse all sites to a single file"""
-    base_df = pd.read_csv(os.path.join(SITE_DIR_LOC, "Site1_WesternSahara1.csv"),
-                          header=0, index_col=0)
+    collapse_groups({"AllSites": sorted(os.listdir(SITE_DIR_LOC))},
+                    os.path.join('data', 'all_sites'))
 
-    collapsed_islands = ["Site1_WesternSahara1.csv"]
-    for file_name in os.listdir(SITE_DIR_LOC):
-        if file_name not in collapsed_islands:
-            collapsed_islands.append(file_name)
-            add_df = pd.read_csv(os.path.join(SITE_DIR_LOC, file_name),
-                                 header=0, index_col=0)
-            base_df = row_col_matching(add_df, base_df)
+#
+def load_site_tensor(site_dir, cache_file):
+    """Load every site file once into one aligned integer tensor of shape
+    pollinators x plants x sites, rows and columns of each site matrix are
+    matched by label. Missing pairs are 0. The tensor is cached in cache_file
+    (.npy) and its labels next to it, both are reused while no site file is
+    newer than the cache. Returns tensor, pollinators, plants and site numbers"""
+    site_files = sorted(os.listdir(site_dir), key=lambda f: int(re.findall(r'\d+', f)[0]))
+    labels_file = os.path.splitext(cache_file)[0] + '_labels.npz'
+    newest = max(os.path.getmtime(os.path.join(site_dir, f)) for f in site_files)
+
+    if os.path.isfile(cache_file) and os.path.isfile(labels_file) and \
+       min(os.path.getmtime(cache_file), os.path.getmtime(labels_file)) >= newest:
+        labels = np.load(labels_file)
+        if list(labels['site_files']) == site_files:
+            return (np.load(cache_file), list(labels['pollinators']),
+                    list(labels['plants']), list(labels['site_nums']))
+
+    site_dfs = [pd.read_csv(os.path.join(site_dir, f), header=0, index_col=0).fillna(0)
+                for f in site_files]
+    pollinators = sorted(set().union(*[df.index for df in site_dfs]))
+    plants = sorted(set().union(*[df.columns for df in site_dfs]))
+    pol_idx = pd.Index(pollinators)
+    plt_idx = pd.Index(plants)
+
+    tensor = np.zeros((len(pollinators), len(plants), len(site_files)), dtype=np.int64)
+    for s, df in enumerate(site_dfs):
+        rows = pol_idx.get_indexer(df.index)
+        cols = plt_idx.get_indexer(df.columns)
+        # Sums rows listed twice in a site file
+        np.add.at(tensor[:, :, s], (rows[:, np.newaxis], cols[np.newaxis, :]),
+                  df.values.astype(np.int64))
+
+    site_nums = [int(re.findall(r'\d+', f)[0]) for f in site_files]
+    np.save(cache_file, tensor)
+    np.savez(labels_file, pollinators=pollinators, plants=plants,
+             site_nums=site_nums, site_files=site_files)
+    return tensor, pollinators, plants, site_nums
 
-    base_df.to_csv('data/all_sites/AllSites.csv')
+#
+def pretty_names(raw_names, lookup, kind):
+    """Array of the summary names of raw_names, raw name kept if not found"""
+    names = []
+    for raw_name in raw_names:
+        try:
+            names.append(lookup[raw_name])
+        except KeyError:
+            print(kind + " not found: ", raw_name)
+            names.append(raw_name)
+    return np.array(names, dtype=object)
+
+#
+def write_edge_list(file_loc, pol_names, plt_names, weights):
+    """Bulk write edge list rows 'E node1name node2name L1wght L2wght ...'"""
+    edges_df = pd.DataFrame(weights)
+    edges_df.insert(0, "Plant", plt_names)
+    edges_df.insert(0, "Pollinator", pol_names)
+    edges_df.insert(0, "Edge", "E")
+    edges_df.to_csv(file_loc, header=None, index=None, sep=" ")
 
 #
-def create_single_layer_adjacency():
+def site_tensor_edges(site_tensor):
+    """Pollinator-plant pairs that interact in any layer as index arrays, with
+    their summary names and the pairs x sites weight array"""
+    tensor, pollinators, plants, site_nums = site_tensor
+    pol, plnt = np.nonzero(tensor.sum(axis=2) > 0)
+    pol_names = pretty_names(pollinators, POLLINATOR_LOOKUP, "Pollinator")[pol]
+    plt_names = pretty_names(plants, PLANT_LOOKUP, "Plant")[plnt]
+    return pol_names, plt_names, tensor[pol, plnt, :]
+
+#
+def create_single_layer_adjacency(site_tensor):
     """Create single adjacency matrices for eventual use in MultiTensor software.
-    Pollinators are rows and plants are columns. Directed so node1 --> node2"""
-    all_sites_df = pd.read_csv(ALL_SITES_FILE_LOC, header=0, index_col=0)
-    all_plants = list(all_sites_df.columns)
-    all_pollinators = list(all_sites_df.index)
+    Pollinators are rows and plants are columns. Directed so node1 --> node2.
+    Each file lists the pairs that interact in any layer, with 0 weight in
+    every layer but its own. There is one layer column per site number up to
+    the largest, so site k is always column 2+k (after E, node1, node2) even
+    for a subset of the sites"""
+    pol_names, plt_names, weights = site_tensor_edges(site_tensor)
+    site_nums = site_tensor[3]
 
     print "Single site adjacency",
-    for file_name in os.listdir(SITE_DIR_LOC):
-        site_df = pd.read_csv(os.path.join(SITE_DIR_LOC, file_name), header=0, index_col=0)
-        site_num = re.findall(r'\d+', file_name)[0]
+    for s, site_num in enumerate(site_nums):
         print site_num, "..",
-
-        # Create list of all possible pollinator-plant pairs
-        all_pol_plt_pairs = list(itertools.product(all_pollinators, all_plants))
-
-        outfile_name = "Site" + site_num + "_Adjacency.dat"
-        with open(os.path.join(ONE_ADJ_DIR_LOC, outfile_name), 'w') as outfile:
-            for pair in all_pol_plt_pairs:
-                try:
-                    pol_pretty_name = POLLINATOR_LOOKUP[pair[0]]
-                except KeyError:
-                    print("Pollinator not found: ", pair[0])
-                    pol_pretty_name = pair[0]
-
-                try:
-                    plt_pretty_name = PLANT_LOOKUP[pair[1]]
-                except KeyError:
-                    print("Plant not found: ", pair[1])
-                    plt_pretty_name = pair[1]
-
-                # Check if pol-plt have interaction in any layer
-                if all_sites_df.loc[pair[0], pair[1]] > 0:
-                    # Row format: E node1name node2name L1wght L2wght L3wght ...
-                    row = ['E', pol_pretty_name, plt_pretty_name] + ['0'] * 14
-                    # Add pol/plt count at this layer if exists, else retain 0
-                    try:
-                        row[2+int(site_num)] = str(site_df.loc[pair[0], pair[1]])
-                    except KeyError:
-                        pass
-
-                    outfile.write(" ".join(row)+'\n')
+        site_weights = np.zeros((len(weights), max(site_nums)), dtype=weights.dtype)
+        site_weights[:, site_num-1] = weights[:, s]
+        outfile_name = "Site" + str(site_num) + "_Adjacency.dat"
+        write_edge_list(os.path.join(ONE_ADJ_DIR_LOC, outfile_name),
+                        pol_names, plt_names, site_weights)
 
 #
-def create_two_layer_adjacency():
+def create_two_layer_adjacency(site_tensor):
     """Create two adjacency matrices for input to MultiTensor software.
     All permutations of length 2 of the sites are created. Whichever
     site is test site has 20% of edges separated for testing prediction."""
-    all_site_pairs = list(itertools.permutations(os.listdir(ONE_ADJ_DIR_LOC), 2))
+    pol_names, plt_names, weights = site_tensor_edges(site_tensor)
+    site_nums = site_tensor[3]
+    all_site_pairs = list(itertools.permutations(range(len(site_nums)), 2))
     print "\nNumber of ordered site pairs", len(all_site_pairs)
-    col_names = ["Edge", "Pollinator", "Plant"]
-
-    for site_pair in all_site_pairs:
-        train_site_num = re.findall(r'\d+', site_pair[0])[0]
-        train_site = pd.read_table(os.path.join(ONE_ADJ_DIR_LOC, site_pair[0]),
-                                   delim_whitespace=True,
-                                   header=None, index_col=False,
-                                   names=col_names+['L'+train_site_num],
-                                   usecols=[0, 1, 2, 2+int(train_site_num)])
-
-        test_site_num = re.findall(r'\d+', site_pair[1])[0]
-        test_site = pd.read_table(os.path.join(ONE_ADJ_DIR_LOC, site_pair[1]),
-                                  delim_whitespace=True,
-                                  header=None, index_col=False,
-                                  names=col_names+['L'+test_site_num],
-                                  usecols=[0, 1, 2, 2+int(test_site_num)])
-
-        # Select 20% of test for holdout and drop from test df
-        test_holdout = test_site.sample(frac=0.2)
-        test_site.drop(test_holdout.index, inplace=True)
-
-        # Combine two layers into single adjacency matrix
-        two_adj_mat = pd.merge(train_site, test_site, how='inner',
-                               on=["Edge", "Pollinator", "Plant"])
-        # TODO Use mask instead of 0 fill value
-        two_adj_mat.fillna(value=0, inplace=True)
-
-        combine_outfile_name = "Sites_" + train_site_num + "_" + test_site_num + "_adjacency.dat"
-        two_adj_mat.to_csv(os.path.join("data", "two_layer_adjacency", combine_outfile_name),
-                           header=None, index=None, sep=" ")
-
-        hold_outfile_name = "Sites_" + train_site_num + "_" + test_site_num + "_holdout.dat"
-        test_holdout.to_csv(os.path.join("data", "two_layer_holdout", hold_outfile_name),
-                            header=None, index=None, sep=" ")
+    num_holdout = int(round(0.2 * len(pol_names)))
+
+    for train, test in all_site_pairs:
+        # Select 20% of test for holdout and drop from the two layers
+        is_holdout = np.zeros(len(pol_names), dtype=bool)
+        is_holdout[np.random.permutation(len(pol_names))[:num_holdout]] = True
+        keep = ~is_holdout
+
+        combine_outfile_name = "Sites_{}_{}_adjacency.dat".format(site_nums[train], site_nums[test])
+        write_edge_list(os.path.join("data", "two_layer_adjacency", combine_outfile_name),
+                        pol_names[keep], plt_names[keep], weights[keep][:, [train, test]])
+
+        hold_outfile_name = "Sites_{}_{}_holdout.dat".format(site_nums[train], site_nums[test])
+        write_edge_list(os.path.join("data", "two_layer_holdout", hold_outfile_name),
+                        pol_names[is_holdout], plt_names[is_holdout],
+                        weights[is_holdout][:, [test]])
 
 #
-def create_all_layer_adjacency():
+def create_all_layer_adjacency(site_tensor):
     """Create one adjacency matrix that has edges for full network.
     Use to select K by maximizing prediction accuracy."""
-    col_names = ["Edge", "Pollinator", "Plant"]
-    print "\nAll site adjacency",
-    for adj_file in os.listdir(ONE_ADJ_DIR_LOC):
-        site_num = re.findall(r'\d+', adj_file)[0]
-        print site_num, "..",
-        adj_mat = pd.read_table(os.path.join(ONE_ADJ_DIR_LOC, adj_file),
-                                delim_whitespace=True,
-                                header=None, index_col=False,
-                                names=col_names+['L'+site_num],
-                                usecols=[0, 1, 2, 2+int(site_num)])
-
-        try:
-            combined_adj_mat = pd.merge(combined_adj_mat, adj_mat,
-                                        how='inner',
-                                        on=["Edge", "Pollinator", "Plant"])
-        except NameError:
-            combined_adj_mat = adj_mat
-
-    combined_adj_mat = combined_adj_mat[["Edge", "Pollinator", "Plant", "L1", "L2", "L3",
-                                         "L4", "L5", "L6", "L7", "L8", "L9", "L10", "L11",
-                                         "L12", "L13", "L14"]]
+    pol_names, plt_names, weights = site_tensor_edges(site_tensor)
+    print "\nAll site adjacency"
 
     # Split adjacency matrix in 80% train and 20% test
-    combined_holdout_mat = combined_adj_mat.sample(frac=0.2)
-    combined_adj_mat.drop(combined_holdout_mat.index, inplace=True)
+    is_holdout = np.zeros(len(pol_names), dtype=bool)
+    is_holdout[np.random.permutation(len(pol_names))[:int(round(0.2 * len(pol_names)))]] = True
+    keep = ~is_holdout
 
-    combined_adj_mat.to_csv(os.path.join("data", "all_layer_adjacency", "AllSites_adjacency.dat"),
-                            header=None, index=None, sep=" ")
-    combined_holdout_mat.to_csv(os.path.join("data", "all_layer_adjacency", "AllSites_holdout.dat"),
-                                header=None, index=None, sep=" ")
+    write_edge_list(os.path.join("data", "all_layer_adjacency", "AllSites_adjacency.dat"),
+                    pol_names[keep], plt_names[keep], weights[keep])
+    write_edge_list(os.path.join("data", "all_layer_adjacency", "AllSites_holdout.dat"),
+                    pol_names[is_holdout], plt_names[is_holdout], weights[is_holdout])
 
 #
 if __name__ == "__main__":
     SITE_DIR_LOC = os.path.join("data", "sites")
     ONE_ADJ_DIR_LOC = os.path.join("data", "one_layer_adjacency")
-    ALL_SITES_FILE_LOC = os.path.join("data", "all_sites", "AllSites.csv")
+    SITE_TENSOR_LOC = os.path.join("data", "site_tensor.npy")
 
     POLLINATOR_LOOKUP, PLANT_LOOKUP = create_node_names(SITE_DIR_LOC)
     # collapse_to_islands()
     # collaps_to_main_islands()
     # collapse_to_single_layer()
-    create_single_layer_adjacency()
-    create_two_layer_adjacency()
-    create_all_layer_adjacency()
+    SITE_TENSOR = load_site_tensor(SITE_DIR_LOC, SITE_TENSOR_LOC)
+    create_single_layer_adjacency(SITE_TENSOR)
+    create_two_layer_adjacency(SITE_TENSOR)
+    create_all_layer_adjacency(SITE_TENSOR)